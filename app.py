@@ -1,24 +1,108 @@
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+
 import uvicorn
-from fastapi import FastAPI, Request, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+from pydantic import BaseModel, Field
 
-from services import ReviewFetcher, ReviewAnalyzer
+import config
+from browser_pool import BrowserPool
+from domain_health import DomainHealth
+from http_fetcher import HttpFetcher
+from model_pool import ModelPool
+from page_store import PageStore
+from result_cache import ResultCache
+from services import search_executor
+from startup import Startup, warm_up
+from job_queue import Job, JobQueue, QueueFullError
+from pipeline import cached_events, has_findings, run_job
 from logger_config import logger
 
 
 templates = Jinja2Templates(directory="templates")
 
-app = FastAPI(title="Product Review Analyzer")
-app.mount("/static", StaticFiles(directory="static"), name="static")
+
+async def run_warm_job(state, job: Job):
+    """Run a queued job once the instance is warm"""
+    await state.startup.wait()
+    await run_job(state, job)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create shared resources and warm them up in the background, releasing them on shutdown.
+
+    The server accepts connections right away: /healthz answers while the model
+    loads and the browser starts, and /readyz only once they are warm. Requests
+    that arrive earlier wait for the warm-up.
+    """
+    app.state.startup = Startup()
+    model_pool = ModelPool(config.MODEL_PATH, size=config.MODEL_POOL_SIZE, context_sizes=config.MODEL_CONTEXT_SIZES,
+                           n_threads=config.MODEL_N_THREADS, memory_budget_mb=config.MODEL_MEMORY_BUDGET_MB,
+                           kv_cache_type=config.MODEL_KV_CACHE_TYPE)
+    app.state.model_pool = model_pool
+    browser_pool = BrowserPool(size=config.BROWSER_POOL_SIZE)
+    app.state.browser_pool = browser_pool
+    app.state.http_fetcher = HttpFetcher(max_connections=config.HTTP_MAX_CONNECTIONS,
+                                     max_page_bytes=config.HTTP_MAX_PAGE_BYTES)
+    app.state.domain_health = DomainHealth(
+        failure_threshold=config.DOMAIN_FAILURE_THRESHOLD, open_seconds=config.DOMAIN_OPEN_SECONDS,
+        max_concurrency=config.DOMAIN_MAX_CONCURRENCY, min_interval=config.DOMAIN_MIN_INTERVAL,
+        # A trial link is fetched within one request's search and fetch deadlines
+        probe_seconds=config.SEARCH_TIMEOUT + config.FETCH_TOTAL_TIMEOUT,
+    )
+    app.state.page_store = PageStore(config.PAGE_STORE_DB, fresh_for=config.PAGE_FRESH_SECONDS,
+                                     max_age=config.PAGE_MAX_AGE)
+    app.state.result_cache = ResultCache(
+        ttl=config.RESULT_CACHE_TTL, max_entries=config.RESULT_CACHE_SIZE, db_path=config.RESULT_CACHE_DB,
+        cacheable=has_findings,
+    )
+    job_queue = JobQueue(lambda job: run_warm_job(app.state, job), workers=config.JOB_WORKERS,
+                         max_queued=config.JOB_QUEUE_SIZE)
+    job_queue.start()
+    app.state.job_queue = job_queue
+    warm_up_task = asyncio.create_task(warm_up(app.state))
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        await asyncio.gather(warm_up_task, return_exceptions=True)
+        await job_queue.stop()
+        app.state.result_cache.close()
+        app.state.page_store.close()
+        await app.state.http_fetcher.close()
+        await browser_pool.close()
+        model_pool.close()
+        # Searches still blocked in a provider are abandoned rather than waited for
+        search_executor().shutdown(wait=False, cancel_futures=True)
+        search_executor.cache_clear()
+
+
+app = FastAPI(title="Product Review Analyzer", lifespan=lifespan)
+app.mount("/static", StaticFiles(directory="static", check_dir=False), name="static")
 
 
 
 # Model for request
 class ProductQuery(BaseModel):
     query: str
+    debug: bool = False
+
+
+class JobRequest(ProductQuery):
+    priority: int = 0
+
+
+class BatchRequest(BaseModel):
+    queries: list[str] = Field(min_length=1, max_length=config.BATCH_MAX_PRODUCTS)
+    # Catalog runs yield to interactive analyses by default
+    priority: int = 1
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -26,42 +110,218 @@ async def root(request: Request):
     """Main page"""
     return templates.TemplateResponse("index.html", {"request": request})
 
+
+def submit_shared_job(job_queue: JobQueue, product_name: str, priority: int = 0) -> Job:
+    """Queue an analysis, or join the queued or running one of the same product"""
+    return job_queue.submit(product_name, priority, key=ResultCache.normalize_key(product_name))
+
+
+async def run_queued_job(job_queue: JobQueue, product_name: str, use_cache: bool = True,
+                         priority: int = 0) -> Job:
+    """Queue an analysis and wait for it to finish, sharing it with identical queries unless the cache is skipped"""
+    if use_cache:
+        job = submit_shared_job(job_queue, product_name, priority)
+    else:
+        job = job_queue.submit(product_name, priority, use_cache=False)
+    await job.wait()
+    if job.status != "done":
+        raise RuntimeError(job.error or "Analysis failed")
+    return job
+
+
+async def analyze_cached(state, product_name: str, priority: int = 0) -> dict:
+    """Result of a product analysis, shared with identical cached or in-flight queries"""
+    cached = state.result_cache.get(product_name)
+    if cached is not None:
+        logger.info(f"Result cache hit for {product_name}")
+        return cached
+    # The shared job runs once for all identical queries and caches its result itself
+    return (await run_queued_job(state.job_queue, product_name, priority=priority)).result()
+
+
 @app.post("/api/analyze")
-async def analyze(query: ProductQuery, background_tasks: BackgroundTasks):
+async def analyze(query: ProductQuery, request: Request, background_tasks: BackgroundTasks):
     """API endpoint for product analysis"""
     try:
         product_name = query.query.strip()
         logger.info(f"Analyzing product: {product_name}")
 
-        # Step 1: Search for product reviews
-        my_reviewer_fetcher = ReviewFetcher(product_name)
-        my_reviewer_fetcher.search_google(num_results=4)  # Limiting to 3 for faster results
-        
-        # Step 2: Extract page content
-        sites_content, site_names = await my_reviewer_fetcher.extract_multiple_pages()
-        logger.info(f"Found {len(sites_content)} sites with reviews")
-
-        # Step 3: Analyze the content
-        my_review_analyzer = ReviewAnalyzer(product_name, sites_content, site_names)
-        product_info = my_review_analyzer.analyze_product()
-        
-        # Step 4: Generate a summary
-        summary = my_review_analyzer.generate_summary()
-        
-        product_info_dict = product_info.as_dict()
-        print(f'product_info_dict->{product_info_dict}')
-        
-        # Step 5: Return the results
-
-        return {
+        job_queue = request.app.state.job_queue
+        if query.debug:
+            # Debug runs skip the cache so the timing breakdown describes a real run
+            job = await run_queued_job(job_queue, product_name, use_cache=False)
+            result = dict(job.result(), timings=job.timings.as_dict())
+        else:
+            # Identical queries share one cached or in-flight analysis, which runs as a queued job
+            result = await analyze_cached(request.app.state, product_name)
+
+        # Return the results
+        response = {
             "success": True, 
-            "product_info": product_info.as_dict(),
-            "summary": summary
+            "product_info": result["product_info"],
+            "summary": result["summary"]
         }
+        if query.debug:
+            response["timings"] = result["timings"]
+        return response
+    except QueueFullError as e:
+        logger.warning(f"Rejected analysis of {query.query}: {e}")
+        return JSONResponse(status_code=429, content={"success": False, "error": str(e)})
     except Exception as e:
         logger.error(f"Error analyzing product: {e}")
         return {"success": False, "error": str(e)}
     
+
+@app.post("/api/jobs", status_code=202)
+async def create_job(query: JobRequest, request: Request):
+    """Queue a product analysis and return its job id immediately"""
+    try:
+        job = request.app.state.job_queue.submit(query.query.strip(), query.priority, use_cache=not query.debug)
+    except QueueFullError as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    logger.info(f"Queued job {job.id} for {job.product_name}")
+    return {"success": True, "job_id": job.id, "status": job.status}
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str, request: Request, debug: bool = False):
+    """Status and partial results of a queued job, with its timing breakdown in debug mode"""
+    job = request.app.state.job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.as_dict(debug)
+
+
+@app.get("/healthz")
+async def healthz(request: Request):
+    """Liveness: the process serves requests, failing only if the warm-up failed"""
+    startup = request.app.state.startup
+    if startup.failed:
+        return JSONResponse(status_code=503, content=startup.as_dict())
+    return {"status": "alive"}
+
+
+@app.get("/readyz")
+async def readyz(request: Request):
+    """Readiness: the model is loaded and exercised and the browser is running"""
+    startup = request.app.state.startup
+    return JSONResponse(status_code=200 if startup.ready else 503, content=startup.as_dict())
+
+
+@app.get("/api/domains")
+async def domains(request: Request):
+    """Fetch history of the domains seen so far, with their circuit state"""
+    return request.app.state.domain_health.as_dict()
+
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus metrics of the pipeline stages, tokens and page fetches"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def sse_message(event: dict) -> str:
+    """Format a pipeline event as a Server-Sent Events message"""
+    return f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/analyze/stream")
+async def analyze_stream(query: ProductQuery, request: Request):
+    """API endpoint streaming search results, each site and the summary as Server-Sent Events.
+
+    Uncached analyses run as queued jobs shared with identical queries, and the
+    events of the job are streamed as they arrive. A client that disconnects
+    leaves the job running for the others, and its result is cached. Answers
+    429 when the job queue is full.
+    """
+    product_name = query.query.strip()
+    logger.info(f"Streaming analysis of product: {product_name}")
+    state = request.app.state
+    cached = state.result_cache.get(product_name)
+    job = None
+    if cached is None:
+        # Shed load before the stream starts, while the status code can still say so
+        try:
+            job = submit_shared_job(state.job_queue, product_name)
+        except QueueFullError as e:
+            logger.warning(f"Rejected analysis of {product_name}: {e}")
+            return JSONResponse(status_code=429, content={"success": False, "error": str(e)})
+
+    async def events():
+        try:
+            if cached is not None:
+                for event in cached_events(cached):
+                    yield sse_message(event)
+                return
+            async for event in job.stream():
+                yield sse_message(event)
+            if job.status != "done":
+                raise RuntimeError(job.error or "Analysis failed")
+        except Exception as e:
+            logger.error(f"Error analyzing product: {e}")
+            yield sse_message({"event": "error", "error": str(e)})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/api/analyze/batch")
+async def analyze_batch(batch: BatchRequest, request: Request):
+    """API endpoint analyzing a list of products, streaming one NDJSON line per product as it finishes.
+
+    Up to BATCH_CONCURRENCY products run as queued jobs at once, so the search of
+    one product, page fetches of another and inference for earlier ones overlap
+    on the shared browser, HTTP and model pools. The last line reports throughput.
+    """
+    state = request.app.state
+    # Indexes refer to positions in the request, blank names are skipped
+    products = [(index, name.strip()) for index, name in enumerate(batch.queries) if name.strip()]
+    logger.info(f"Batch analysis of {len(products)} products")
+
+    async def analyze_one(index: int, product_name: str, semaphore: asyncio.Semaphore) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            line = {"event": "product", "index": index, "query": product_name}
+            while True:
+                try:
+                    result = await analyze_cached(state, product_name, batch.priority)
+                    line.update(success=True, product_info=result["product_info"], summary=result["summary"])
+                    break
+                except QueueFullError:
+                    # Other clients filled the queue, the batch can wait for room
+                    await asyncio.sleep(1)
+                except Exception as e:
+                    logger.error(f"Error analyzing {product_name} in batch: {e}")
+                    line.update(success=False, error=str(e))
+                    break
+            line["seconds"] = time.perf_counter() - start
+            return line
+
+    async def lines():
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(config.BATCH_CONCURRENCY)
+        tasks = [asyncio.create_task(analyze_one(index, name, semaphore)) for index, name in products]
+        succeeded = 0
+        try:
+            for finished in asyncio.as_completed(tasks):
+                line = await finished
+                succeeded += line["success"]
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        seconds = time.perf_counter() - start
+        yield json.dumps({
+            "event": "report",
+            "products": len(products),
+            "succeeded": succeeded,
+            "failed": len(products) - succeeded,
+            "seconds": seconds,
+            "products_per_minute": len(products) / seconds * 60 if seconds else None,
+        }) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
     # Запуск приложения
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
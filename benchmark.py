@@ -0,0 +1,462 @@
+"""Offline benchmark of the review pipeline.
+
+Runs without network or model: search results point at a local server that
+serves the bundled content.txt, and Llama is replaced by a deterministic stub.
+Every other result is a client-rendered page whose static HTML is an empty
+shell, so it goes through the browser tier, where urllib stands in for Chromium.
+Stage timings come from one run and peak memory from a second, traced run.
+Results are written as JSON and can be compared with a stored baseline:
+
+    python benchmark.py --output bench.json
+    python benchmark.py --baseline bench.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import functools
+import json
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import types
+import urllib.request
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent
+# Requests with this header get the rendered fixture from client-rendered paths
+RENDERED_HEADER = "X-Fixture-Rendered"
+CLIENT_RENDERED_PREFIX = "/spa/"
+SHELL_HTML = b'<html><head><title>Loading</title></head><body><div id="app"></div><script src="/app.js"></script></body></html>'
+FIXTURE_HTML = BASE_DIR / "content.txt"
+PRODUCT_NAME = "Samsung Galaxy A55"
+
+
+class StubLlama:
+    """Deterministic stand-in for llama_cpp.Llama"""
+    # GGUF metadata of gemma-2-2b, so the model pool can size KV caches
+    metadata = {
+        "general.architecture": "gemma2",
+        "gemma2.block_count": "26",
+        "gemma2.embedding_length": "2304",
+        "gemma2.attention.head_count": "8",
+        "gemma2.attention.head_count_kv": "4",
+        "gemma2.attention.key_length": "256",
+        "gemma2.attention.value_length": "256",
+    }
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list[int]:
+        tokens = list(range(len(text) // 4 + 1))
+        return [0] + tokens if add_bos else tokens
+
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __call__(self, prompt: str, grammar=None, stream: bool = False, **kwargs):
+        if grammar is not None:
+            text = json.dumps({"rating": 8.5, "scale": 10, "pros": ["Bright screen", "Long battery life"],
+                               "cons": ["Slow charging"]})
+        else:
+            text = "A solid mid-range phone with a great screen and battery."
+        if stream:
+            # One chunk per word, standing in for one per token
+            return ({"choices": [{"text": piece}]} for piece in re.split(r"(?<= )", text))
+        return {"choices": [{"text": text}]}
+
+
+class StubGrammar:
+    """Stand-in for llama_cpp.LlamaGrammar"""
+    @classmethod
+    def from_json_schema(cls, json_schema: str, verbose: bool = True) -> "StubGrammar":
+        return cls()
+
+
+def install_stub_llama():
+    """Make the pipeline use StubLlama, even when llama_cpp is not installed"""
+    try:
+        import llama_cpp
+    except ImportError:
+        llama_cpp = sys.modules["llama_cpp"] = types.SimpleNamespace(LlamaGrammar=StubGrammar)
+    # The model pool imports Llama when it loads, so patching the module is enough
+    llama_cpp.Llama = StubLlama
+
+
+class FixtureServer:
+    """Serves the fixture page on every path of a local port; client-rendered paths only serve it to the browser"""
+    def __init__(self, body: bytes):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                rendered = not self.path.startswith(CLIENT_RENDERED_PREFIX) or self.headers.get(RENDERED_HEADER)
+                page = body if rendered else SHELL_HTML
+                self.send_response(200)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(page)))
+                self.end_headers()
+                self.wfile.write(page)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def url(self, path: str) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/{path}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+class FixturePage:
+    """The part of a Playwright page used by ReviewFetcher, loading rendered pages with urllib"""
+    def __init__(self):
+        self._content = ""
+
+    def on(self, event, handler):
+        pass
+
+    async def goto(self, url: str, wait_until: str = None, timeout: float = None):
+        def load():
+            request = urllib.request.Request(url, headers={RENDERED_HEADER: "1"})
+            with urllib.request.urlopen(request, timeout=(timeout or 30000) / 1000) as response:
+                return response.read().decode("utf-8")
+        self._content = await asyncio.to_thread(load)
+
+    async def evaluate(self, script: str):
+        pass
+
+    async def wait_for_function(self, expression: str, arg=None, timeout: float = None):
+        # The page is complete once loaded, there is nothing to wait for
+        pass
+
+    async def content(self) -> str:
+        return self._content
+
+
+class FixtureBrowserPool:
+    """Replaces BrowserPool, bounding concurrent pages the same way"""
+    def __init__(self, size: int = 4):
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def start(self):
+        pass
+
+    @asynccontextmanager
+    async def page(self):
+        async with self._semaphore:
+            yield FixturePage()
+
+
+class StageTimer:
+    """Collects durations of wrapped functions by stage name, and which stages are running"""
+    def __init__(self):
+        self.samples = defaultdict(list)
+        self.recording = True
+        self.sampler = None
+        self._running = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def running(self) -> list[str]:
+        with self._lock:
+            return [stage for stage, calls in self._running.items() if calls]
+
+    def wrap(self, owner, name: str, stage: str):
+        func = getattr(owner, name)
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def timed(*args, **kwargs):
+                start = self._enter(stage)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    self._exit(stage, start)
+        else:
+            @functools.wraps(func)
+            def timed(*args, **kwargs):
+                start = self._enter(stage)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self._exit(stage, start)
+        setattr(owner, name, timed)
+
+    def _enter(self, stage: str) -> float:
+        with self._lock:
+            self._running[stage] += 1
+        if self.sampler is not None:
+            self.sampler.sample()
+        return time.perf_counter()
+
+    def _exit(self, stage: str, start: float):
+        seconds = time.perf_counter() - start
+        if self.sampler is not None:
+            # Catches stages too short for the sampling interval
+            self.sampler.sample()
+        with self._lock:
+            self._running[stage] -= 1
+            if self.recording:
+                self.samples[stage].append(seconds)
+
+
+class MemorySampler:
+    """Samples traced Python memory, keeping the peak seen while each stage was running.
+
+    Stages of concurrent requests overlap, so a stage's peak is that of the whole
+    process while the stage was running, not memory the stage allocated itself.
+    """
+    def __init__(self, timer: StageTimer, interval: float = 0.002):
+        self.peaks = defaultdict(int)
+        self._timer = timer
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        tracemalloc.start()
+        self._timer.sampler = self
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self._timer.sampler = None
+        _, self.peaks["end_to_end"] = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    def sample(self):
+        current, _ = tracemalloc.get_traced_memory()
+        for stage in self._timer.running():
+            self.peaks[stage] = max(self.peaks[stage], current)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.sample()
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def summarize(samples: list[float], wall_time: float | None = None, peak_memory: int | None = None) -> dict:
+    """Latency percentiles, throughput and peak memory of one stage"""
+    wall_time = wall_time if wall_time is not None else sum(samples)
+    return {
+        "runs": len(samples),
+        "p50_ms": percentile(samples, 0.5) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "mean_ms": sum(samples) / len(samples) * 1000,
+        "throughput_per_s": len(samples) / wall_time if wall_time else None,
+        "peak_memory_mb": peak_memory / 2 ** 20 if peak_memory is not None else None,
+    }
+
+
+def measure(func, runs: int) -> dict:
+    """Time a synchronous stage on its own, then trace one extra run for its peak Python memory"""
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    # tracemalloc slows everything down, so it is kept out of the timed runs
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return summarize(samples, peak_memory=peak)
+
+
+def bench_stages(html: str, runs: int) -> dict:
+    """Benchmark the CPU stages in isolation"""
+    from chunk_selector import select_chunks
+    from markdown_converter import html_to_markdown
+    from services import ReviewAnalyzer
+
+    import config
+
+    cleaned = html_to_markdown(html)
+    llm = StubLlama()
+    count_tokens = lambda text: len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def analyze():
+        analyzer = ReviewAnalyzer(PRODUCT_NAME, [cleaned], ["Fixture"], llm)
+        analyzer.analyze_product()
+
+    return {
+        "clean": measure(lambda: html_to_markdown(html), runs),
+        "select_chunks": measure(
+            lambda: select_chunks(cleaned, PRODUCT_NAME, count_tokens, config.CONTENT_TOKEN_BUDGET, config.CHUNK_SIZE),
+            runs,
+        ),
+        "analyze_stub": measure(analyze, runs),
+    }
+
+
+async def bench_end_to_end(server: FixtureServer, requests: int, concurrency: int, memory_requests: int) -> dict:
+    """Run /api/analyze through the ASGI app with local fixtures behind every stage.
+
+    The timed requests run untraced; memory_requests more then run under
+    tracemalloc to find the peak memory of each stage.
+    """
+    import httpx
+
+    import app as app_module
+    import config
+    import services
+    from domain_health import DomainHealth
+    from http_fetcher import HttpFetcher
+    from job_queue import JobQueue
+    from model_pool import ModelPool
+    from page_store import PageStore
+    from pipeline import NUM_RESULTS, run_job
+    from result_cache import ResultCache
+    from startup import Startup, warm_up
+
+    timer = StageTimer()
+    ddgs = lambda: types.SimpleNamespace(
+        text=lambda query, max_results: [{"href": server.url(f"{'spa/' if i % 2 else ''}ddg/{i}")}
+                                         for i in range(max_results)]
+    )
+    search = lambda query, num_results: iter(server.url(f"{'spa/' if i % 2 else ''}google/{i}")
+                                             for i in range(num_results))
+    services.search_providers = lambda: (ddgs, search)
+    timer.wrap(services.ReviewFetcher, "search_google", "search")
+    timer.wrap(services.ReviewFetcher, "_extract_page", "fetch_page")
+    timer.wrap(services.ReviewFetcher, "_fetch_static", "fetch_http")
+    timer.wrap(services.ReviewFetcher, "_fetch_rendered", "fetch_browser")
+    timer.wrap(services.ReviewFetcher, "read_page", "clean")
+    timer.wrap(services.ReviewAnalyzer, "prepare_site", "prepare_site")
+    timer.wrap(services.ReviewAnalyzer, "finish_site", "analyze_site")
+    timer.wrap(services.ReviewAnalyzer, "generate_summary", "summary")
+
+    app = app_module.app
+    state = app.state
+    state.model_pool = ModelPool(config.MODEL_PATH, size=config.MODEL_POOL_SIZE,
+                                 context_sizes=config.MODEL_CONTEXT_SIZES,
+                                 memory_budget_mb=config.MODEL_MEMORY_BUDGET_MB,
+                                 kv_cache_type=config.MODEL_KV_CACHE_TYPE)
+    state.browser_pool = FixtureBrowserPool(config.BROWSER_POOL_SIZE)
+    state.startup = Startup()
+    await warm_up(state)
+    await state.startup.wait()
+    state.http_fetcher = HttpFetcher(max_connections=config.HTTP_MAX_CONNECTIONS,
+                                 max_page_bytes=config.HTTP_MAX_PAGE_BYTES)
+    # Expire results and pages immediately so every request runs the full pipeline
+    state.result_cache = ResultCache(ttl=0)
+    state.page_store = PageStore(":memory:", fresh_for=0)
+    # Every page comes from the same local server, which stands in for many sites: don't throttle it
+    state.domain_health = DomainHealth(max_concurrency=requests * NUM_RESULTS, min_interval=0)
+    state.job_queue = JobQueue(lambda job: run_job(state, job), workers=config.JOB_WORKERS,
+                               max_queued=requests + memory_requests)
+    state.job_queue.start()
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one_request(client, num):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post("/api/analyze", json={"query": f"{PRODUCT_NAME} {num}"})
+            if timer.recording:
+                latencies.append(time.perf_counter() - start)
+            data = response.json()
+            if not data.get("success"):
+                raise RuntimeError(f"Request {num} failed: {data}")
+
+    transport = httpx.ASGITransport(app=app)
+    peaks = {}
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(one_request(client, num) for num in range(requests)))
+            wall_time = time.perf_counter() - started
+            if memory_requests:
+                # tracemalloc slows everything down, so it is kept out of the timed requests
+                timer.recording = False
+                with MemorySampler(timer) as sampler:
+                    await asyncio.gather(*(one_request(client, num) for num in range(requests, requests + memory_requests)))
+                peaks = sampler.peaks
+    finally:
+        await state.job_queue.stop()
+        await state.http_fetcher.close()
+        state.page_store.close()
+        state.model_pool.close()
+
+    stages = {stage: summarize(samples, peak_memory=peaks.get(stage)) for stage, samples in timer.samples.items()}
+    stages["end_to_end"] = summarize(latencies, wall_time=wall_time, peak_memory=peaks.get("end_to_end"))
+    return stages
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> list[str]:
+    """Print p50 changes against the baseline and return the stages that regressed"""
+    regressions = []
+    for section, stages in results.items():
+        for stage, stats in stages.items():
+            before = baseline.get(section, {}).get(stage)
+            if not before:
+                continue
+            change = (stats["p50_ms"] - before["p50_ms"]) / before["p50_ms"] if before["p50_ms"] else 0.0
+            print(f"{section}.{stage}: p50 {before['p50_ms']:.2f} ms -> {stats['p50_ms']:.2f} ms ({change:+.1%})")
+            if change > max_regression:
+                regressions.append(f"{section}.{stage}")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=20, help="runs of each isolated stage")
+    parser.add_argument("--requests", type=int, default=8, help="end-to-end /api/analyze requests")
+    parser.add_argument("--concurrency", type=int, default=4, help="requests in flight at once")
+    parser.add_argument("--memory-requests", type=int, default=4,
+                        help="extra requests traced for the peak memory of each pipeline stage, 0 to skip")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write the results")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="fail when a stage p50 is this much slower than the baseline")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(BASE_DIR))
+    install_stub_llama()
+    html = FIXTURE_HTML.read_text(encoding="utf-8")
+
+    results = {"stages": bench_stages(html, args.runs)}
+    with FixtureServer(html.encode("utf-8")) as server:
+        results["pipeline"] = asyncio.run(
+            bench_end_to_end(server, args.requests, args.concurrency, args.memory_requests)
+        )
+
+    Path(args.output).write_text(json.dumps(results, indent=2))
+    for section, stages in results.items():
+        for stage, stats in stages.items():
+            print(f"{section}.{stage}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, "
+                  f"{stats['throughput_per_s'] or 0:.2f}/s")
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"Slower than baseline: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import asyncio
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+from logger_config import logger
+
+# Requests the browser does not need to render the text of a page
+BLOCKED_RESOURCE_TYPES = {'image', 'media', 'font'}
+BLOCKED_DOMAINS = (
+    'doubleclick.net', 'googlesyndication.com', 'googleadservices.com', 'google-analytics.com',
+    'googletagmanager.com', 'googletagservices.com', 'adservice.google.com', 'amazon-adsystem.com',
+    'adnxs.com', 'criteo.com', 'criteo.net', 'taboola.com', 'outbrain.com', 'scorecardresearch.com',
+    'quantserve.com', 'hotjar.com', 'facebook.net', 'rlcdn.com', 'adsrvr.org', 'mc.yandex.ru',
+)
+
+
+def is_blocked(url: str, resource_type: str) -> bool:
+    """Whether a browser request is for heavy resources or a known ad/tracker"""
+    if resource_type in BLOCKED_RESOURCE_TYPES:
+        return True
+    host = urlparse(url).hostname or ''
+    return any(host == domain or host.endswith('.' + domain) for domain in BLOCKED_DOMAINS)
+
+
+async def _route_request(route):
+    if is_blocked(route.request.url, route.request.resource_type):
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+class BrowserPool:
+    """Long-lived headless Chromium with a pool of reusable browser contexts"""
+    def __init__(self, size: int = 4, headless: bool = True):
+        self._size = max(1, size)
+        self._headless = headless
+        self._playwright = None
+        self._browser = None
+        self._contexts = []
+        self._available = asyncio.Queue()
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    async def start(self):
+        """Launch the browser and open the contexts, called once at application startup"""
+        # Imported here so that importing the app does not load Playwright
+        from playwright.async_api import async_playwright
+        logger.info(f"Starting Chromium with {self._size} browser contexts")
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(headless=self._headless)
+        for _ in range(self._size):
+            context = await self._browser.new_context()
+            await context.route("**/*", _route_request)
+            self._contexts.append(context)
+            self._available.put_nowait(context)
+
+    @asynccontextmanager
+    async def page(self):
+        """Open a page in a free context, waiting while all contexts are busy"""
+        context = await self._available.get()
+        page = None
+        try:
+            page = await context.new_page()
+            yield page
+        finally:
+            if page is not None:
+                await page.close()
+            self._available.put_nowait(context)
+
+    async def close(self):
+        """Close the contexts, the browser and Playwright"""
+        for context in self._contexts:
+            await context.close()
+        self._contexts.clear()
+        self._available = asyncio.Queue()
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
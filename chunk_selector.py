@@ -0,0 +1,85 @@
+import math
+import re
+from collections import Counter
+from typing import Callable
+
+# Words that mark review content, in the languages our search results come in
+REVIEW_VOCABULARY = {
+    'review', 'reviews', 'rating', 'rated', 'stars', 'score', 'verdict', 'pros', 'cons',
+    'advantages', 'disadvantages', 'recommend', 'excellent', 'great', 'good', 'bad',
+    'poor', 'best', 'worst', 'problem', 'issue', 'quality', 'battery', 'price',
+    'відгук', 'відгуки', 'оцінка', 'рейтинг', 'плюси', 'мінуси', 'переваги', 'недоліки',
+    'отзыв', 'отзывы', 'оценка', 'плюсы', 'минусы', 'достоинства', 'недостатки',
+}
+PRODUCT_TERM_WEIGHT = 3.0
+REVIEW_TERM_WEIGHT = 1.0
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+
+def _terms(text: str) -> list[str]:
+    return re.findall(r'\w+', text.lower())
+
+
+def split_chunks(text: str, chunk_size: int = 480) -> list[str]:
+    """Split text into chunks of whole lines of at most about chunk_size characters"""
+    chunks = []
+    current = []
+    length = 0
+    for line in text.split('\n'):
+        if current and length + len(line) > chunk_size:
+            chunks.append('\n'.join(current))
+            current = []
+            length = 0
+        current.append(line)
+        length += len(line) + 1
+    if current:
+        chunks.append('\n'.join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def score_chunks(chunks: list[str], product_name: str) -> list[float]:
+    """Score every chunk with BM25 against the product name and the review vocabulary"""
+    query = {term: REVIEW_TERM_WEIGHT for term in REVIEW_VOCABULARY}
+    query.update({term: PRODUCT_TERM_WEIGHT for term in _terms(product_name)})
+
+    chunk_terms = [Counter(_terms(chunk)) for chunk in chunks]
+    if not chunk_terms:
+        return []
+    avg_length = sum(sum(terms.values()) for terms in chunk_terms) / len(chunk_terms) or 1
+    document_frequency = Counter(term for terms in chunk_terms for term in terms if term in query)
+
+    scores = []
+    for terms in chunk_terms:
+        length = sum(terms.values())
+        score = 0.0
+        for term, weight in query.items():
+            frequency = terms.get(term)
+            if not frequency:
+                continue
+            df = document_frequency[term]
+            idf = math.log(1 + (len(chunk_terms) - df + 0.5) / (df + 0.5))
+            norm = frequency + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+            score += weight * idf * frequency * (BM25_K1 + 1) / norm
+        scores.append(score)
+    return scores
+
+
+def select_chunks(text: str, product_name: str, count_tokens: Callable[[str], int],
+                  token_budget: int, chunk_size: int = 480) -> str:
+    """Keep the chunks most relevant to the product that fit into the token budget.
+
+    Chunks are picked best first and returned in page order.
+    """
+    chunks = split_chunks(text, chunk_size)
+    scores = score_chunks(chunks, product_name)
+    ranked = sorted(range(len(chunks)), key=lambda i: scores[i], reverse=True)
+
+    selected = []
+    remaining = token_budget
+    for i in ranked:
+        tokens = count_tokens(chunks[i])
+        if tokens <= remaining:
+            selected.append(i)
+            remaining -= tokens
+    return '\n'.join(chunks[i] for i in sorted(selected))
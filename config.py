@@ -0,0 +1,61 @@
+import os
+
+# Language model
+MODEL_PATH = os.getenv("MODEL_PATH", "../models/gemma-2-2b-it.Q8_0.gguf")
+MODEL_POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", "1"))
+# Split the cores between the pooled models so concurrent analyses don't oversubscribe the CPU
+MODEL_N_THREADS = int(os.getenv("MODEL_N_THREADS", max(1, (os.cpu_count() or 1) // MODEL_POOL_SIZE)))
+# Each analysis gets the smallest of these context sizes that fits its prompt and answer
+MODEL_CONTEXT_SIZES = tuple(int(size) for size in os.getenv("MODEL_CONTEXT_SIZES", "2048,4096,8192").split(","))
+# Estimated KV cache memory all contexts may use together, unlimited if unset
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("MODEL_MEMORY_BUDGET_MB", "0")) or None
+MODEL_KV_CACHE_TYPE = os.getenv("MODEL_KV_CACHE_TYPE", "f16")
+
+# Page content sent to the model
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "480"))
+CONTENT_TOKEN_BUDGET = int(os.getenv("CONTENT_TOKEN_BUDGET", "1024"))
+
+# Search
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT", "10"))
+# Extra search results kept to replace pages that fail to load
+SEARCH_SPARE_RESULTS = int(os.getenv("SEARCH_SPARE_RESULTS", "3"))
+# Threads of the search clients, kept apart from the threads that run inference
+SEARCH_THREADS = int(os.getenv("SEARCH_THREADS", "8"))
+
+# Page fetching
+BROWSER_POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "4"))
+FETCH_URL_TIMEOUT = float(os.getenv("FETCH_URL_TIMEOUT", "30"))
+FETCH_TOTAL_TIMEOUT = float(os.getenv("FETCH_TOTAL_TIMEOUT", "45"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+# Larger static pages are dropped while downloading, the limit applies to the decompressed body
+HTTP_MAX_PAGE_BYTES = int(os.getenv("HTTP_MAX_PAGE_BYTES", str(5 * 2 ** 20)))
+STATIC_FETCH_TIMEOUT = float(os.getenv("STATIC_FETCH_TIMEOUT", "10"))
+# Cleaned static pages shorter than this are rendered in the browser instead
+STATIC_MIN_CHARS = int(os.getenv("STATIC_MIN_CHARS", "1500"))
+CONTENT_READY_TIMEOUT = float(os.getenv("CONTENT_READY_TIMEOUT", "5"))
+
+# Domain health: consecutive failures open a domain's circuit, skipping it for a while
+DOMAIN_FAILURE_THRESHOLD = int(os.getenv("DOMAIN_FAILURE_THRESHOLD", "3"))
+DOMAIN_OPEN_SECONDS = float(os.getenv("DOMAIN_OPEN_SECONDS", "600"))
+DOMAIN_MAX_CONCURRENCY = int(os.getenv("DOMAIN_MAX_CONCURRENCY", "2"))
+DOMAIN_MIN_INTERVAL = float(os.getenv("DOMAIN_MIN_INTERVAL", "0.5"))
+
+# Analysis results
+RESULT_CACHE_TTL = float(os.getenv("RESULT_CACHE_TTL", "3600"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB") or None
+
+# Fetched pages
+PAGE_STORE_DB = os.getenv("PAGE_STORE_DB", "pages.db")
+# Stored pages are used without a request while fresh, then revalidated until they are too old
+PAGE_FRESH_SECONDS = float(os.getenv("PAGE_FRESH_SECONDS", "3600"))
+PAGE_MAX_AGE = float(os.getenv("PAGE_MAX_AGE", str(7 * 24 * 3600)))
+
+# Background jobs
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", MODEL_POOL_SIZE * 2))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "16"))
+
+# Batch analysis
+BATCH_MAX_PRODUCTS = int(os.getenv("BATCH_MAX_PRODUCTS", "500"))
+# Products of one batch in the job queue at once, so their stages overlap without flooding the queue
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", JOB_WORKERS))
@@ -0,0 +1,151 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+import metrics
+from logger_config import logger
+
+# Weight of the newest fetch in the latency average
+LATENCY_SMOOTHING = 0.3
+# Analyses of a domain before its usefulness is judged
+MIN_ANALYSES = 3
+
+
+class DomainStats:
+    """Fetch history and limits of one domain"""
+    def __init__(self, max_concurrency: int):
+        self.fetches = 0
+        self.successes = 0
+        self.consecutive_failures = 0
+        self.latency = None
+        self.analyses = 0
+        self.useful = 0
+        self.open_until = 0.0
+        self.probe_until = 0.0
+        self.next_start = 0.0
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def useless(self) -> bool:
+        """Analyzed often enough and never gave the model anything to extract"""
+        return self.analyses >= MIN_ANALYSES and self.useful == 0
+
+    def as_dict(self) -> dict:
+        return {
+            "fetches": self.fetches,
+            "success_rate": self.successes / self.fetches if self.fetches else None,
+            "consecutive_failures": self.consecutive_failures,
+            "latency_seconds": self.latency,
+            "analyses": self.analyses,
+            "useful_rate": self.useful / self.analyses if self.analyses else None,
+            "open_for_seconds": max(0.0, self.open_until - time.time()),
+            "probing": self.probe_until > time.time(),
+        }
+
+
+class DomainHealth:
+    """Per-domain fetch history with a circuit breaker, concurrency and rate limits.
+
+    After failure_threshold failures in a row a domain's circuit opens and its links
+    are skipped for open_seconds. Once that passes the next link allowed is a trial:
+    other links of the domain are skipped until its fetch is recorded, or for
+    probe_seconds if it never is. Success closes the circuit, another failure opens
+    it again right away.
+    """
+    def __init__(self, failure_threshold: int = 3, open_seconds: float = 600, max_concurrency: int = 2,
+                 min_interval: float = 0.5, max_domains: int = 5000, probe_seconds: float = 60):
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._probe_seconds = probe_seconds
+        self._max_concurrency = max_concurrency
+        self._min_interval = min_interval
+        self._max_domains = max_domains
+        self._domains = OrderedDict()
+
+    @staticmethod
+    def domain(url: str) -> str:
+        host = urlparse(url).hostname or ""
+        return host.removeprefix("www.")
+
+    def allow(self, url: str) -> bool:
+        """Whether a link to the url's domain may be fetched, taking the trial fetch of a half-open circuit"""
+        stats = self._domains.get(self.domain(url))
+        if stats is None or not stats.open_until:
+            return True
+        now = time.time()
+        if stats.open_until > now or stats.probe_until > now:
+            return False
+        stats.probe_until = now + self._probe_seconds
+        metrics.record_domain_event("probed")
+        logger.info(f"Trying {self.domain(url)} again with {url}")
+        return True
+
+    def is_open(self, url: str) -> bool:
+        """Whether the url's domain is refusing requests, without taking a trial fetch"""
+        stats = self._domains.get(self.domain(url))
+        return stats is not None and stats.open_until > time.time()
+
+    def demoted(self, url: str) -> bool:
+        """Whether the url's domain proved useless or unreliable"""
+        stats = self._domains.get(self.domain(url))
+        if stats is None:
+            return False
+        unreliable = stats.fetches >= MIN_ANALYSES and stats.successes * 2 < stats.fetches
+        return stats.useless or unreliable
+
+    def rank(self, urls: list[str]) -> list[str]:
+        """Order links so domains that proved useless or unreliable come last, keeping search order otherwise"""
+        return sorted(urls, key=self.demoted)
+
+    @asynccontextmanager
+    async def slot(self, url: str):
+        """Hold one of the domain's concurrent request slots, spacing request starts by min_interval"""
+        stats = self._stats(url)
+        async with stats.semaphore:
+            now = time.monotonic()
+            start = max(now, stats.next_start)
+            stats.next_start = start + self._min_interval
+            if start > now:
+                await asyncio.sleep(start - now)
+            yield
+
+    def record_fetch(self, url: str, ok: bool, seconds: float | None = None):
+        stats = self._stats(url)
+        stats.fetches += 1
+        if seconds is not None:
+            stats.latency = seconds if stats.latency is None else (
+                LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * stats.latency
+            )
+        if ok:
+            stats.successes += 1
+            stats.consecutive_failures = 0
+            stats.open_until = stats.probe_until = 0.0
+            return
+        stats.consecutive_failures += 1
+        if stats.consecutive_failures >= self._failure_threshold:
+            stats.open_until = time.time() + self._open_seconds
+            stats.probe_until = 0.0
+            metrics.record_domain_event("opened")
+            logger.warning(f"Circuit of {self.domain(url)} opened for {self._open_seconds:.0f}s "
+                           f"after {stats.consecutive_failures} failed fetches")
+
+    def record_analysis(self, url: str, useful: bool):
+        """Record whether the model found any data on a page of the domain"""
+        stats = self._stats(url)
+        stats.analyses += 1
+        stats.useful += useful
+
+    def as_dict(self) -> dict:
+        return {domain: stats.as_dict() for domain, stats in self._domains.items()}
+
+    def _stats(self, url: str) -> DomainStats:
+        domain = self.domain(url)
+        stats = self._domains.get(domain)
+        if stats is None:
+            stats = self._domains[domain] = DomainStats(self._max_concurrency)
+            while len(self._domains) > self._max_domains:
+                self._domains.popitem(last=False)
+        self._domains.move_to_end(domain)
+        return stats
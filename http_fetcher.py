@@ -0,0 +1,95 @@
+import codecs
+import re
+
+import httpx
+
+from logger_config import logger
+
+# <meta charset="..."> or <meta http-equiv="Content-Type" content="text/html; charset=...">
+META_CHARSET = re.compile(rb"""<meta[^>]+charset\s*=\s*["']?\s*([\w.:-]+)""", re.IGNORECASE)
+# HTML requires the charset declaration within the first 1024 bytes; allow for sloppy pages
+META_CHARSET_BYTES = 4096
+
+HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        "(KHTML, like Gecko) Chrome/133.0.0.0 Safari/537.36"
+    ),
+    "Accept": "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8",
+    "Accept-Language": "en-US,en;q=0.9,uk;q=0.8",
+}
+
+
+class StaticPage:
+    """HTML of a page, or only the news that it did not change, with its cache validators"""
+    def __init__(self, html: str | None, etag: str | None = None, last_modified: str | None = None,
+                 not_modified: bool = False):
+        self.html = html
+        self.etag = etag
+        self.last_modified = last_modified
+        self.not_modified = not_modified
+
+
+class HttpFetcher:
+    """Shared HTTP client with keep-alive, HTTP/2 and compressed responses for static pages"""
+    def __init__(self, max_connections: int = 20, max_page_bytes: int = 5 * 2 ** 20):
+        self._max_page_bytes = max_page_bytes
+        self._client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            headers=HEADERS,
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+        )
+
+    async def fetch(self, url: str, timeout: float, etag: str | None = None,
+                    last_modified: str | None = None) -> StaticPage | None:
+        """Return the page, or None if the server did not answer with HTML of at most max_page_bytes.
+
+        With validators of a stored copy the request is conditional, and an
+        unchanged page comes back as not_modified without its HTML. The status and
+        headers are checked before the body is downloaded, so PDFs, binaries and
+        oversized pages are dropped without transferring them.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        async with self._client.stream("GET", url, timeout=timeout, headers=headers) as response:
+            if response.status_code == 304 and headers:
+                return StaticPage(None, response.headers.get("etag", etag),
+                                  response.headers.get("last-modified", last_modified), not_modified=True)
+            content_type = response.headers.get("content-type", "")
+            if response.status_code >= 400 or "html" not in content_type:
+                logger.info(f"Static fetch of {url} returned {response.status_code} {content_type}")
+                return None
+            length = response.headers.get("content-length", "")
+            if length.isdigit() and int(length) > self._max_page_bytes:
+                logger.info(f"Static fetch of {url} skipped, {length} bytes announced")
+                return None
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > self._max_page_bytes:
+                    logger.info(f"Static fetch of {url} stopped after {len(body)} bytes")
+                    return None
+            html = body.decode(page_encoding(response, body), errors="replace")
+            return StaticPage(html, response.headers.get("etag"), response.headers.get("last-modified"))
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def page_encoding(response: httpx.Response, body: bytes) -> str:
+    """Charset of the Content-Type header, else of a <meta> tag near the start of the page, else UTF-8"""
+    candidates = [response.charset_encoding]
+    if match := META_CHARSET.search(body[:META_CHARSET_BYTES]):
+        candidates.append(match.group(1).decode("ascii"))
+    for name in candidates:
+        if not name:
+            continue
+        try:
+            return codecs.lookup(name).name
+        except LookupError:
+            logger.info(f"Unknown charset {name!r} of {response.url}")
+    return "utf-8"
@@ -0,0 +1,171 @@
+import asyncio
+import itertools
+import time
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from logger_config import logger
+from metrics import RequestTimings
+
+
+class QueueFullError(Exception):
+    """Raised when the job queue cannot take more jobs"""
+
+
+class Job:
+    """Analysis of one product running in the background"""
+    def __init__(self, product_name: str, priority: int = 0, use_cache: bool = True, key: str | None = None):
+        self.id = uuid.uuid4().hex
+        self.product_name = product_name
+        self.priority = priority
+        self.use_cache = use_cache
+        self.key = key
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.sites = []
+        self.summary = None
+        self.error = None
+        self.timings = RequestTimings()
+        self.events = []
+        self._finished = asyncio.Event()
+        self._updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._finished.is_set()
+
+    def apply(self, event: dict):
+        """Record a pipeline event as partial results"""
+        self.events.append(event)
+        self._notify()
+        if event["event"] == "search":
+            self.sites = [{"site_name": site["site_name"], "rating": None, "pros": None, "cons": None}
+                          for site in event["sites"]]
+        elif event["event"] == "site":
+            self.sites[event["index"]] = event["site"]
+        elif event["event"] == "summary":
+            self.sites = event["product_info"]
+            self.summary = event["summary"]
+
+    def result(self) -> dict:
+        return {"product_info": self.sites, "summary": self.summary}
+
+    def finish(self):
+        self.finished_at = time.time()
+        self._finished.set()
+        self._notify()
+
+    async def stream(self):
+        """Yield the job's pipeline events from the first one, then as they arrive, until it finishes"""
+        sent = 0
+        while True:
+            updated = self._updated
+            while sent < len(self.events):
+                yield self.events[sent]
+                sent += 1
+            if self.finished:
+                return
+            await updated.wait()
+
+    def _notify(self):
+        """Wake up every stream waiting for the next event"""
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def wait(self) -> "Job":
+        await self._finished.wait()
+        return self
+
+    def as_dict(self, debug: bool = False) -> dict:
+        data = {
+            "job_id": self.id,
+            "query": self.product_name,
+            "priority": self.priority,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "product_info": self.sites,
+            "summary": self.summary,
+            "error": self.error,
+        }
+        if debug:
+            data["timings"] = self.timings.as_dict()
+        return data
+
+
+class JobQueue:
+    """Runs jobs on a fixed number of workers, lowest priority value first, FIFO within a priority"""
+    def __init__(self, run_job: Callable[[Job], Awaitable[None]], workers: int = 2,
+                 max_queued: int = 16, max_finished: int = 256):
+        self._run_job = run_job
+        self._workers = max(1, workers)
+        self._max_queued = max_queued
+        self._max_finished = max_finished
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._jobs = OrderedDict()
+        self._shared = {}
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self._workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, product_name: str, priority: int = 0, use_cache: bool = True, key: str | None = None) -> Job:
+        """Queue a job or raise QueueFullError when too many jobs are waiting.
+
+        Jobs submitted with the same key while one of them is queued or running are
+        one job: later submissions get the unfinished job instead of a new one.
+        """
+        if key is not None and key in self._shared:
+            logger.info(f"Joining in-flight job {self._shared[key].id} for {product_name}")
+            return self._shared[key]
+        if self._queue.qsize() >= self._max_queued:
+            raise QueueFullError(f"Too many queued jobs ({self._max_queued}), try again later")
+        job = Job(product_name, priority, use_cache, key)
+        self._jobs[job.id] = job
+        if key is not None:
+            self._shared[key] = job
+        self._queue.put_nowait((priority, next(self._order), job))
+        self._prune()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                await self._run_job(job)
+                job.status = "done"
+            except asyncio.CancelledError:
+                job.status = "failed"
+                job.error = "Cancelled"
+                raise
+            except Exception as e:
+                logger.error(f"Job {job.id} for {job.product_name} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                if job.key is not None:
+                    self._shared.pop(job.key, None)
+                job.finish()
+                self._queue.task_done()
+
+    def _prune(self):
+        """Forget the oldest finished jobs above the retention limit"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self._max_finished)]:
+            del self._jobs[job_id]
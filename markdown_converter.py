@@ -0,0 +1,121 @@
+import re
+
+from lxml import etree
+from lxml import html as lxml_html
+
+# Elements dropped together with everything inside them
+REMOVED_TAGS = {'script', 'style', 'iframe', 'noscript', 'svg', 'canvas'}
+# Elements whose own text is not page content
+HIDDEN_TEXT_TAGS = {'template', 'rt', 'rp'}
+# Order in which elements are converted: an element only sees the conversion
+# of the elements that come before it, e.g. a paragraph inside a list item is
+# already plain text when the list is built, but a link inside it is not
+STAGES = {
+    'h1': 1, 'h2': 2, 'h3': 3, 'h4': 4, 'h5': 5, 'h6': 6,
+    'p': 7, 'ul': 8, 'ol': 9, 'table': 10, 'a': 11, 'img': 12,
+}
+ALL_STAGES = max(STAGES.values()) + 1
+
+
+def parse_html(content: str):
+    """Parse page HTML into an lxml tree, None for a page without any elements"""
+    if not content.strip():
+        return None
+    parser = lxml_html.HTMLParser(encoding='utf-8')
+    try:
+        return lxml_html.document_fromstring(content.encode('utf-8'), parser=parser)
+    except etree.ParserError:
+        # Nothing but comments or whitespace, an empty page rather than a failed one
+        return None
+
+
+def html_to_markdown(content: str) -> str:
+    """Convert page HTML to Markdown-like text in a single walk over the lxml tree"""
+    return tree_to_markdown(parse_html(content))
+
+
+def tree_to_markdown(root) -> str:
+    """Convert a tree from parse_html to Markdown-like text, leaving the tree unchanged"""
+    if root is None:
+        return "# No title\n\n"
+
+    # Save page title
+    title_tag = next(root.iter('title'), None)
+    title = ''.join(title_tag.itertext()) if title_tag is not None else "No title"
+
+    parts = []
+    _convert_children(root, ALL_STAGES, parts, hidden=False)
+    # Get cleaned text
+    cleaned_text = '\n'.join(part.strip() for part in parts if part.strip())
+
+    # Clean text from multiple line breaks and spaces
+    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
+    cleaned_text = re.sub(r' {2,}', ' ', cleaned_text)
+
+    # Add page title at the beginning
+    return f"# {title}\n\n{cleaned_text}"
+
+
+def _convert_children(element, stage: int, parts: list[str], hidden: bool):
+    """Append the text of the element's children, converting elements of earlier stages"""
+    if element.text and not hidden:
+        parts.append(element.text)
+    for child in element:
+        if isinstance(child.tag, str):
+            _convert_element(child, stage, parts, hidden)
+        if child.tail and not hidden:
+            parts.append(child.tail)
+
+
+def _convert_element(element, stage: int, parts: list[str], hidden: bool):
+    """Append the text of an element, converted if its stage comes before `stage`"""
+    tag = element.tag
+    if tag in REMOVED_TAGS or tag == 'br':
+        return
+    if tag == 'hr':
+        parts.append('\n---\n')
+        return
+
+    own_stage = STAGES.get(tag, ALL_STAGES)
+    if own_stage < stage:
+        if tag == 'p':
+            parts.append(f"\n{_inner_text(element, own_stage, hidden)}\n")
+            return
+        if tag in ('ul', 'ol'):
+            new_content = "\n"
+            items = [child for child in element if child.tag == 'li']
+            for i, li in enumerate(items, 1):
+                marker = '*' if tag == 'ul' else f"{i}."
+                new_content += f"{marker} {_inner_text(li, own_stage, hidden)}\n"
+            parts.append(new_content)
+            return
+        if tag == 'table':
+            new_content = "\n<TABLE>\n"
+            for row in element.iter('tr'):
+                cells = [cell for cell in row.iter('th', 'td')]
+                row_content = " | ".join(_inner_text(cell, own_stage, hidden) for cell in cells)
+                new_content += f"{row_content}\n"
+            new_content += "</TABLE>\n"
+            parts.append(new_content)
+            return
+        if tag == 'a':
+            text = _inner_text(element, own_stage, hidden)
+            if element.get('href') and text:
+                parts.append(f"[{text}]({element.get('href')})")
+                return
+        elif tag == 'img':
+            parts.append(f"![{element.get('alt', 'image')}]({element.get('src', '')})")
+            return
+        else:
+            # Headings
+            parts.append(f"\n{'#' * own_stage} {_inner_text(element, own_stage, hidden)}\n")
+            return
+
+    _convert_children(element, stage, parts, hidden or tag in HIDDEN_TEXT_TAGS)
+
+
+def _inner_text(element, stage: int, hidden: bool) -> str:
+    """Stripped text of an element as seen by a conversion of the given stage"""
+    parts = []
+    _convert_children(element, stage, parts, hidden or element.tag in HIDDEN_TEXT_TAGS)
+    return ''.join(part.strip() for part in parts)
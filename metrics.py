@@ -0,0 +1,120 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from prometheus_client import Counter, Gauge, Histogram
+
+STAGE_SECONDS = Histogram(
+    "reviewer_stage_seconds", "Wall time of pipeline stages", ["stage"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+TOKENS = Counter("reviewer_tokens_total", "Tokens evaluated or generated by the model", ["kind"])
+PROMPT_SPEED = Histogram(
+    "reviewer_prompt_tokens_per_second", "Prompt tokens evaluated per second",
+    buckets=(25, 50, 100, 200, 400, 800, 1600, 3200),
+)
+GENERATION_SPEED = Histogram(
+    "reviewer_generation_tokens_per_second", "Completion tokens generated per second, after prompt evaluation",
+    buckets=(1, 2, 5, 10, 20, 40, 80, 160),
+)
+PAGE_FETCHES = Counter("reviewer_page_fetches_total", "Page fetches by outcome", ["outcome"])
+PAGE_BYTES = Counter("reviewer_page_bytes_total", "Bytes of page HTML fetched")
+PAGE_STORE_LOOKUPS = Counter("reviewer_page_store_lookups_total", "Page store lookups by result", ["result"])
+STARTUP_SECONDS = Gauge("reviewer_startup_seconds", "Duration of each application startup phase", ["phase"])
+DOMAIN_EVENTS = Counter("reviewer_domain_events_total", "Domain circuit breaker events", ["event"])
+
+
+class RequestTimings:
+    """Timing breakdown of one analysis, returned to the client in debug mode"""
+    def __init__(self):
+        self.stages = {}
+        self.tokens = {"prompt": 0, "completion": 0}
+        self.prompt_seconds = 0.0
+        self.generation_seconds = 0.0
+        self.pages = []
+
+    def add_stage(self, stage: str, seconds: float):
+        entry = self.stages.setdefault(stage, {"count": 0, "seconds": 0.0})
+        entry["count"] += 1
+        entry["seconds"] += seconds
+
+    def as_dict(self) -> dict:
+        prompt_per_second = self.tokens["prompt"] / self.prompt_seconds if self.prompt_seconds else None
+        tokens_per_second = (self.tokens["completion"] / self.generation_seconds
+                             if self.generation_seconds else None)
+        return {
+            "stages": self.stages,
+            "tokens": dict(self.tokens, prompt_per_second=prompt_per_second,
+                           completion_per_second=tokens_per_second),
+            "pages": self.pages,
+        }
+
+
+# Timings of the analysis running in the current task, if anyone asked for them
+_current_timings = ContextVar("current_timings", default=None)
+
+
+@contextmanager
+def track_timings(timings: RequestTimings):
+    """Record everything measured inside the block, and in tasks started from it, into timings"""
+    token = _current_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _current_timings.reset(token)
+
+
+def record_stage(stage: str, seconds: float):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.add_stage(stage, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Measure the wall time of a block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def record_tokens(prompt: int, completion: int = 0, prompt_seconds: float = 0.0, generation_seconds: float = 0.0):
+    """Account a completion: prompt_seconds until the first token, generation_seconds for the rest"""
+    TOKENS.labels("prompt").inc(prompt)
+    TOKENS.labels("completion").inc(completion)
+    if prompt and prompt_seconds:
+        PROMPT_SPEED.observe(prompt / prompt_seconds)
+    # The first token is sampled within prompt_seconds
+    if completion > 1 and generation_seconds:
+        GENERATION_SPEED.observe((completion - 1) / generation_seconds)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.tokens["prompt"] += prompt
+        timings.tokens["completion"] += completion
+        timings.prompt_seconds += prompt_seconds
+        timings.generation_seconds += generation_seconds
+
+
+def record_page_store(result: str):
+    """Count a page store lookup: fresh, revalidated, changed or miss"""
+    PAGE_STORE_LOOKUPS.labels(result).inc()
+
+
+def record_startup(phase: str, seconds: float):
+    STARTUP_SECONDS.labels(phase).set(seconds)
+
+
+def record_domain_event(event: str):
+    """Count a domain event: a circuit opened, a trial fetch admitted, a link skipped or a failed page refilled"""
+    DOMAIN_EVENTS.labels(event).inc()
+
+
+def record_page(url: str, outcome: str, seconds: float | None = None, size: int = 0):
+    PAGE_FETCHES.labels(outcome).inc()
+    PAGE_BYTES.inc(size)
+    timings = _current_timings.get()
+    if timings is not None:
+        timings.pages.append({"url": url, "outcome": outcome, "seconds": seconds, "bytes": size})
@@ -0,0 +1,194 @@
+import asyncio
+import functools
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING
+
+from logger_config import logger
+
+if TYPE_CHECKING:
+    from llama_cpp import Llama
+
+# Context size of the vocab-only tokenizer, the smallest llama.cpp allocates
+TOKENIZER_CONTEXT = 32
+
+# GGML type id and bytes per element of the supported KV cache types
+KV_CACHE_TYPES = {
+    "f16": (1, 2.0),
+    "q8_0": (8, 34 / 32),
+    "q4_0": (2, 18 / 32),
+}
+
+
+def kv_bytes_per_token(metadata: dict, element_size: float) -> float | None:
+    """Estimate the KV cache size of one token from GGUF metadata, None if it is incomplete"""
+    try:
+        arch = metadata["general.architecture"]
+        layers = int(metadata[f"{arch}.block_count"])
+        heads = int(metadata[f"{arch}.attention.head_count"])
+        kv_heads = int(metadata.get(f"{arch}.attention.head_count_kv", heads))
+        key_length = int(metadata.get(f"{arch}.attention.key_length",
+                                      int(metadata[f"{arch}.embedding_length"]) // heads))
+        value_length = int(metadata.get(f"{arch}.attention.value_length", key_length))
+    except (KeyError, ValueError):
+        return None
+    return layers * kv_heads * (key_length + value_length) * element_size
+
+
+class ModelPool:
+    """Keeps warm Llama contexts of a few sizes and hands them out one site analysis at a time.
+
+    Model weights are memory-mapped and shared, so what a context costs is mostly
+    its KV cache. Each checkout gets the smallest context size that fits the
+    requested tokens; at most `size` contexts exist at once, and their estimated
+    KV cache stays within memory_budget_mb.
+    """
+    def __init__(self, model_path: str, size: int = 1, context_sizes: tuple[int, ...] = (2048, 4096, 8192),
+                 n_threads: int | None = None, memory_budget_mb: float | None = None, kv_cache_type: str = "f16"):
+        if kv_cache_type not in KV_CACHE_TYPES:
+            raise ValueError(f"Unknown KV cache type {kv_cache_type!r}, expected one of {', '.join(KV_CACHE_TYPES)}")
+        self._model_path = model_path
+        self._size = max(1, size)
+        self._context_sizes = sorted(set(context_sizes))
+        self._n_threads = n_threads
+        self._budget = memory_budget_mb * 2 ** 20 if memory_budget_mb else None
+        self._kv_cache_type = kv_cache_type
+        self._bytes_per_token = None
+        self._kv_bytes = 0
+        self._active = 0
+        self._idle = {n_ctx: [] for n_ctx in self._context_sizes}
+        self._released = asyncio.Event()
+        self.tokenizer = None
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def load(self):
+        """Load the tokenizer and warm contexts of the smallest size, called once at application startup"""
+        from llama_cpp import Llama
+        logger.info(f"Loading tokenizer from {self._model_path}")
+        # A vocab-only Llama still creates a context; keep it minimal, tokenizing does not use it
+        self.tokenizer = Llama(model_path=self._model_path, vocab_only=True, n_ctx=TOKENIZER_CONTEXT,
+                               n_batch=TOKENIZER_CONTEXT, verbose=False)
+        self._bytes_per_token = kv_bytes_per_token(getattr(self.tokenizer, "metadata", {}),
+                                                   KV_CACHE_TYPES[self._kv_cache_type][1])
+        if self._budget is not None:
+            if self._bytes_per_token is None:
+                logger.warning("Model metadata does not describe its KV cache, the memory budget is not enforced")
+                self._budget = None
+            else:
+                fitting = [n_ctx for n_ctx in self._context_sizes if self._kv_cost(n_ctx) <= self._budget]
+                if not fitting:
+                    raise ValueError(f"A {self._context_sizes[0]}-token context does not fit the memory budget")
+                self._context_sizes = fitting
+                self._idle = {n_ctx: [] for n_ctx in fitting}
+
+        n_ctx = self._context_sizes[0]
+        for num in range(self._size):
+            if not self._has_room(n_ctx, contexts=num):
+                break
+            logger.info(f"Loading model {num + 1}/{self._size} with a {n_ctx}-token context")
+            self._kv_bytes += self._kv_cost(n_ctx)
+            self._idle[n_ctx].append(self._create(n_ctx))
+
+    def warm_up(self, prompt: str = "Hello"):
+        """Run a one-token generation on every loaded context.
+
+        This pages in the memory-mapped weights and allocates compute buffers at
+        startup rather than during the first request.
+        """
+        for contexts in self._idle.values():
+            for llm in contexts:
+                llm(prompt, max_tokens=1)
+                llm.reset()
+
+    def context_size(self, n_tokens: int) -> int:
+        """Smallest context size that holds n_tokens, or the largest one"""
+        return next((n_ctx for n_ctx in self._context_sizes if n_ctx >= n_tokens), self._context_sizes[-1])
+
+    @asynccontextmanager
+    async def acquire(self, n_tokens: int = 0):
+        """Check out a model whose context holds n_tokens, waiting while the pool or memory budget is full"""
+        n_ctx = self.context_size(n_tokens)
+        while not self._can_start(n_ctx):
+            self._released.clear()
+            await self._released.wait()
+        self._active += 1
+        llm = self._idle[n_ctx].pop() if self._idle[n_ctx] else None
+        try:
+            if llm is None:
+                llm = await self._create_context(n_ctx)
+            yield llm
+        finally:
+            self._active -= 1
+            if llm is not None:
+                llm.reset()
+                self._idle[n_ctx].append(llm)
+            self._released.set()
+
+    def close(self):
+        """Release all loaded models"""
+        for contexts in self._idle.values():
+            for llm in contexts:
+                llm.close()
+            contexts.clear()
+        self._kv_bytes = 0
+        if self.tokenizer is not None:
+            self.tokenizer.close()
+            self.tokenizer = None
+
+    def _kv_cost(self, n_ctx: int) -> float:
+        return n_ctx * (self._bytes_per_token or 0)
+
+    def _idle_count(self) -> int:
+        return sum(len(contexts) for contexts in self._idle.values())
+
+    def _has_room(self, n_ctx: int, contexts: int) -> bool:
+        """Whether a new n_ctx context fits next to `contexts` existing ones"""
+        if contexts >= self._size:
+            return False
+        return self._budget is None or self._kv_bytes + self._kv_cost(n_ctx) <= self._budget
+
+    def _can_start(self, n_ctx: int) -> bool:
+        """Whether a checkout of n_ctx can proceed, reusing or evicting idle contexts if needed"""
+        if self._active >= self._size:
+            return False
+        if self._idle[n_ctx]:
+            return True
+        idle_bytes = sum(self._kv_cost(size) * len(contexts) for size, contexts in self._idle.items())
+        return self._budget is None or self._kv_bytes - idle_bytes + self._kv_cost(n_ctx) <= self._budget
+
+    async def _create_context(self, n_ctx: int) -> "Llama":
+        """Make room by closing idle contexts of other sizes, then create an n_ctx context in a thread"""
+        for size in sorted(self._idle, reverse=True):
+            while self._idle[size] and not self._has_room(n_ctx, self._active - 1 + self._idle_count()):
+                self._idle[size].pop().close()
+                self._kv_bytes -= self._kv_cost(size)
+        self._kv_bytes += self._kv_cost(n_ctx)
+        task = asyncio.ensure_future(asyncio.to_thread(self._create, n_ctx))
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            # The thread keeps creating the context, hand it to the next caller when done
+            task.add_done_callback(functools.partial(self._keep_created, n_ctx))
+            raise
+        except Exception:
+            self._kv_bytes -= self._kv_cost(n_ctx)
+            raise
+
+    def _keep_created(self, n_ctx: int, task: asyncio.Future):
+        if task.cancelled() or task.exception() is not None:
+            self._kv_bytes -= self._kv_cost(n_ctx)
+        else:
+            self._idle[n_ctx].append(task.result())
+        self._released.set()
+
+    def _create(self, n_ctx: int) -> "Llama":
+        from llama_cpp import Llama
+        type_id = KV_CACHE_TYPES[self._kv_cache_type][0]
+        params = {}
+        if self._kv_cache_type != "f16":
+            # llama.cpp needs flash attention for a quantized V cache
+            params = {"type_k": type_id, "type_v": type_id, "flash_attn": True}
+        logger.info(f"Creating a {n_ctx}-token context ({self._kv_cost(n_ctx) / 2 ** 20:.0f} MB KV cache)")
+        return Llama(model_path=self._model_path, n_ctx=n_ctx, n_threads=self._n_threads, verbose=False, **params)
@@ -0,0 +1,154 @@
+"""Fetched pages by URL, kept on disk between runs.
+
+Besides serving the fetcher, the store can replay pages offline, e.g. to see what
+the current cleaner makes of a stored page:
+
+    python page_store.py pages.db
+    python page_store.py pages.db https://example.com/review --clean
+"""
+import argparse
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+
+from logger_config import logger
+
+# Fastest zlib level: every fetched page is compressed while a request waits, and HTML still shrinks ~6x
+COMPRESSION_LEVEL = 1
+# Seconds between deletions of pages older than max_age
+PRUNE_INTERVAL = 600
+
+
+class StoredPage:
+    """A page from the store; the compressed content is only unpacked when read"""
+    def __init__(self, url: str, html: bytes, markdown: bytes, etag: str | None,
+                 last_modified: str | None, fetched: float):
+        self.url = url
+        self._html = html
+        self._markdown = markdown
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+
+    @property
+    def html(self) -> str:
+        return zlib.decompress(self._html).decode("utf-8")
+
+    @property
+    def markdown(self) -> str:
+        return zlib.decompress(self._markdown).decode("utf-8")
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched
+
+
+class PageStore:
+    """Raw HTML and cleaned Markdown of fetched pages in SQLite, with the validators to revalidate them.
+
+    Safe to use from several threads, so that compressing and writing large pages
+    can be kept off the event loop.
+    """
+    def __init__(self, db_path: str, fresh_for: float = 3600, max_age: float = 7 * 24 * 3600):
+        self._fresh_for = fresh_for
+        self._max_age = max_age
+        self._next_prune = 0.0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS pages (url TEXT PRIMARY KEY, html BLOB, markdown BLOB, "
+            "etag TEXT, last_modified TEXT, fetched REAL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS pages_fetched ON pages(fetched)")
+        self._db.commit()
+
+    def get(self, url: str) -> StoredPage | None:
+        """Return the stored page, or None if there is none younger than max_age"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT html, markdown, etag, last_modified, fetched FROM pages WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None:
+            return None
+        page = StoredPage(url, *row)
+        if page.age > self._max_age:
+            return None
+        return page
+
+    def is_fresh(self, page: StoredPage) -> bool:
+        """Whether the page can be used without asking the server"""
+        return page.age <= self._fresh_for
+
+    def put(self, url: str, html: str, markdown: str, etag: str | None = None, last_modified: str | None = None):
+        """Store a fetched page, dropping pages older than max_age every PRUNE_INTERVAL seconds"""
+        html_blob = zlib.compress(html.encode("utf-8"), COMPRESSION_LEVEL)
+        markdown_blob = zlib.compress(markdown.encode("utf-8"), COMPRESSION_LEVEL)
+        fetched = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO pages (url, html, markdown, etag, last_modified, fetched) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (url, html_blob, markdown_blob, etag, last_modified, fetched),
+            )
+            if fetched >= self._next_prune:
+                self._db.execute("DELETE FROM pages WHERE fetched < ?", (fetched - self._max_age,))
+                self._next_prune = fetched + PRUNE_INTERVAL
+            self._db.commit()
+
+    def touch(self, url: str, etag: str | None = None, last_modified: str | None = None):
+        """Mark a stored page as just revalidated"""
+        with self._lock:
+            self._db.execute(
+                "UPDATE pages SET fetched = ?, etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified) "
+                "WHERE url = ?",
+                (time.time(), etag, last_modified, url),
+            )
+            self._db.commit()
+
+    def urls(self) -> list[tuple[str, float]]:
+        with self._lock:
+            return self._db.execute("SELECT url, fetched FROM pages ORDER BY fetched DESC").fetchall()
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_path", help="page store database")
+    parser.add_argument("url", nargs="?", help="page to print; lists the stored pages when omitted")
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument("--html", action="store_true", help="print the raw HTML instead of the Markdown")
+    output.add_argument("--clean", action="store_true", help="clean the raw HTML again with the current cleaner")
+    args = parser.parse_args()
+
+    store = PageStore(args.db_path, max_age=float("inf"))
+    try:
+        if args.url is None:
+            for url, fetched in store.urls():
+                print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(fetched))}  {url}")
+            return 0
+        page = store.get(args.url)
+        if page is None:
+            logger.error(f"{args.url} is not in {args.db_path}")
+            return 1
+        if args.html:
+            print(page.html)
+        elif args.clean:
+            from markdown_converter import html_to_markdown
+            print(html_to_markdown(page.html))
+        else:
+            print(page.markdown)
+        return 0
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
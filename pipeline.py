@@ -0,0 +1,128 @@
+import asyncio
+
+import metrics
+from logger_config import logger
+from services import REVIEW_MAX_TOKENS, SUMMARY_MAX_TOKENS, ReviewFetcher, ReviewAnalyzer
+
+NUM_RESULTS = 4
+
+
+async def run_blocking(func, *args):
+    """Run blocking model work in a thread.
+
+    If the caller is cancelled the thread still owns the model, so we wait for it
+    to finish before letting the model go back to the pool.
+    """
+    task = asyncio.ensure_future(asyncio.to_thread(func, *args))
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        await task
+        raise
+
+
+async def stream_analysis(state, product_name: str):
+    """Search, fetch and analyze reviews of a product, yielding events as stages finish.
+
+    Events are dictionaries with an "event" key: "search" with the found sites,
+    "site" for each analyzed site in the order they finish, and "summary" at the end.
+    A site whose page failed to load may be replaced by another search result, so
+    "site" events carry the url that was actually analyzed.
+    Each page is analyzed as soon as it is loaded, on whichever model of the pool is
+    free and has a context large enough, so sites of one product are analyzed in parallel.
+    """
+    # Step 1: Search for product reviews
+    my_reviewer_fetcher = ReviewFetcher(product_name, state.browser_pool, state.http_fetcher, state.page_store,
+                                        state.domain_health)
+    links = await my_reviewer_fetcher.search_google(num_results=NUM_RESULTS)
+    site_names = list(my_reviewer_fetcher.site_names)
+    yield {
+        "event": "search",
+        "sites": [{"site_name": name, "url": url} for name, url in zip(site_names, links)],
+    }
+
+    my_review_analyzer = ReviewAnalyzer(product_name, [""] * len(links), site_names,
+                                        tokenizer=state.model_pool.tokenizer)
+    events = asyncio.Queue()
+
+    async def analyze(index, site_name, content, structured):
+        prompt = await asyncio.to_thread(my_review_analyzer.prepare_site, index, content, site_name, structured)
+        if prompt is None:
+            site = my_review_analyzer.finish_site(index, None)
+        else:
+            # Check out a context just big enough for this prompt and its answer
+            n_tokens = my_review_analyzer.context_tokens(prompt, REVIEW_MAX_TOKENS)
+            async with state.model_pool.acquire(n_tokens) as llm:
+                site = await run_blocking(my_review_analyzer.finish_site, index, prompt, llm)
+        url = my_reviewer_fetcher.links[index]
+        if content.strip() or structured is not None:
+            # Remember which domains give the model something to extract
+            state.domain_health.record_analysis(url, my_review_analyzer.description.has_data(index))
+        events.put_nowait({"event": "site", "index": index, "url": url, "site": site})
+
+    async def fetch_and_analyze():
+        # Step 2 and 3: Analyze each page as soon as it is loaded
+        tasks = []
+        try:
+            async for page in my_reviewer_fetcher.iter_pages():
+                tasks.append(asyncio.create_task(analyze(*page)))
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            events.put_nowait(None)
+
+    producer = asyncio.create_task(fetch_and_analyze())
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+        await producer
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+    logger.info(f"Analyzed {len(links)} sites for {product_name}")
+
+    # Step 4: Generate a summary
+    n_tokens = my_review_analyzer.context_tokens(my_review_analyzer.summary_prompt(), SUMMARY_MAX_TOKENS)
+    async with state.model_pool.acquire(n_tokens) as llm:
+        summary = await run_blocking(my_review_analyzer.generate_summary, llm)
+
+    yield {
+        "event": "summary",
+        "product_info": my_review_analyzer.description.as_dict(),
+        "summary": summary,
+    }
+
+
+async def run_job(state, job):
+    """Run the pipeline for a queued job, recording partial results and timings as they arrive"""
+    cached = state.result_cache.get(job.product_name) if job.use_cache else None
+    if cached is not None:
+        for event in cached_events(cached):
+            job.apply(event)
+        return
+    with metrics.track_timings(job.timings), metrics.stage("pipeline"):
+        async for event in stream_analysis(state, job.product_name):
+            job.apply(event)
+    state.result_cache.set(job.product_name, job.result())
+
+
+def has_findings(result: dict) -> bool:
+    """Whether any site of a result has a rating, pros or cons.
+
+    Results without any come from failed searches or fetches, and are not worth caching.
+    """
+    return any(
+        site.get(field, "No data") != "No data"
+        for site in result["product_info"] for field in ("rating", "pros", "cons")
+    )
+
+
+def cached_events(result: dict):
+    """Replay a cached result as the events of a finished analysis"""
+    product_info = result["product_info"]
+    yield {"event": "search", "sites": [{"site_name": site["site_name"]} for site in product_info]}
+    for index, site in enumerate(product_info):
+        yield {"event": "site", "index": index, "site": site}
+    yield {"event": "summary", "product_info": product_info, "summary": result["summary"]}
@@ -0,0 +1,84 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from typing import Callable
+
+from logger_config import logger
+
+
+class ResultCache:
+    """Analysis results by product name with TTL and LRU eviction.
+
+    Results rejected by `cacheable` are not stored. Concurrent analyses of one
+    product are shared by the job queue, which stores the result once.
+    """
+    def __init__(self, ttl: float = 3600, max_entries: int = 256, db_path: str | None = None,
+                 cacheable: Callable[[dict], bool] | None = None):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._cacheable = cacheable
+        self._entries = OrderedDict()
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT, created REAL)"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def normalize_key(product_name: str) -> str:
+        return " ".join(product_name.lower().split())
+
+    def get(self, product_name: str) -> dict | None:
+        """Return a fresh cached result or None"""
+        key = self.normalize_key(product_name)
+        entry = self._entries.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                entry = (json.loads(row[0]), row[1])
+                self._remember(key, entry)
+        if entry is None:
+            return None
+
+        value, created = entry
+        if time.time() - created > self._ttl:
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, product_name: str, value: dict):
+        """Store a result, evicting the least recently used entries over the size limit"""
+        if self._cacheable is not None and not self._cacheable(value):
+            logger.info(f"Not caching the result for {product_name}")
+            return
+        key = self.normalize_key(product_name)
+        created = time.time()
+        self._remember(key, (value, created))
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO results (key, value, created) VALUES (?, ?, ?)",
+                (key, json.dumps(value), created),
+            )
+            self._db.execute("DELETE FROM results WHERE created < ?", (created - self._ttl,))
+            self._db.commit()
+
+    def _remember(self, key: str, entry: tuple[dict, float]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key: str):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._db.commit()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -1,50 +1,198 @@
 import asyncio
+import contextlib
+import functools
+import json
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
 
-from bs4 import BeautifulSoup
-from duckduckgo_search import DDGS
-from googlesearch import search
-from llama_cpp import Llama
-from playwright.async_api import async_playwright
-
+import config
+import metrics
+from chunk_selector import select_chunks
+from http_fetcher import StaticPage
 from logger_config import logger
+from markdown_converter import parse_html, tree_to_markdown
+from page_store import StoredPage
+from structured_data import StructuredReview, extract_structured_data, has_structured_data
+
+if TYPE_CHECKING:
+    from llama_cpp import LlamaGrammar
+
+# The page has rendered its text, or finished loading with whatever text it has
+CONTENT_READY_JS = """
+    minLength => document.body && (
+        document.body.innerText.length >= minLength || document.readyState === 'complete'
+    )
+"""
+
+# What the model must answer for each site; short lists keep the generation small
+REVIEW_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "rating": {"anyOf": [{"type": "number"}, {"type": "null"}]},
+        "scale": {"enum": [5, 10, 100]},
+        "pros": {"type": "array", "items": {"type": "string", "maxLength": 60}, "maxItems": 4},
+        "cons": {"type": "array", "items": {"type": "string", "maxLength": 60}, "maxItems": 4},
+    },
+    "required": ["rating", "scale", "pros", "cons"],
+}
+# What is asked instead when the page publishes a trusted rating of the product
+NOTES_SCHEMA = {
+    "type": "object",
+    "properties": {key: REVIEW_SCHEMA["properties"][key] for key in ("pros", "cons")},
+    "required": ["pros", "cons"],
+}
+REVIEW_MAX_TOKENS = 256
+# Time that must be left before the fetch deadline to try a spare link instead of a failed one
+MIN_REFILL_SECONDS = 5
+SUMMARY_MAX_TOKENS = 250
+
+
+# llama_cpp, Playwright and the search clients are imported on first use, so that importing
+# the app stays fast and the cost is paid in the startup warm-up instead
+
+
+@functools.cache
+def review_grammar(with_rating: bool = True) -> "LlamaGrammar":
+    """GBNF grammar of REVIEW_SCHEMA, or of NOTES_SCHEMA without the rating, compiled once"""
+    from llama_cpp import LlamaGrammar
+    schema = REVIEW_SCHEMA if with_rating else NOTES_SCHEMA
+    return LlamaGrammar.from_json_schema(json.dumps(schema), verbose=False)
+
+
+@functools.cache
+def search_providers() -> tuple:
+    """DuckDuckGo client class and Google search function"""
+    from duckduckgo_search import DDGS
+    from googlesearch import search
+    return DDGS, search
+
+
+@functools.cache
+def search_executor() -> ThreadPoolExecutor:
+    """Threads of the search clients, so that slow providers never hold threads that inference needs"""
+    return ThreadPoolExecutor(max_workers=config.SEARCH_THREADS, thread_name_prefix="search")
+
 
 class ReviewFetcher:
     """Class for searching and cleaning information"""
-    def __init__(self, query: str):
+    def __init__(self, query: str, browser_pool, http_fetcher=None, page_store=None, domain_health=None):
         self._found_prod_name = query.strip()
+        self._browser_pool = browser_pool
+        self._http_fetcher = http_fetcher
+        self._page_store = page_store
+        self._domain_health = domain_health
         self._links = []
         self._site_names = []  # Added to store site names
         self._additional_links = set()
+        self._spare_links = []
+        self._spare_search = None
+        self._fetch_stats = {}
+
+    async def search_google(self, num_results: int = 5, timeout: float = config.SEARCH_TIMEOUT,
+                            spare_results: int = config.SEARCH_SPARE_RESULTS) -> list[str]:
+        """Searches links through DuckDuckGo and Google at the same time.
+
+        Both providers run in worker threads and stream links back as they are found;
+        the search returns once num_results unique links are collected, and the timeout
+        drops whichever provider is still running. Links to domains with an open circuit
+        are skipped, and links to domains that proved useless or unreliable are only used
+        if nothing better turns up. Up to spare_results extra links to replace failed
+        pages keep being collected in the background after the search returns.
+        """
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        found = asyncio.Queue()
+        stop = threading.Event()
+        wanted = num_results + spare_results
+        DDGS, search = search_providers()
+        providers = {
+            "DuckDuckGo": lambda: (result.get("href") for result in
+                                   DDGS().text("ukraine " + self._found_prod_name, max_results=wanted)),
+            "Google": lambda: search("review users " + self._found_prod_name, num_results=wanted),
+        }
+
+        def publish(item):
+            try:
+                loop.call_soon_threadsafe(found.put_nowait, item)
+            except RuntimeError:
+                # The event loop is already closed, nobody is waiting for results
+                stop.set()
+
+        def run(name, results):
+            try:
+                for link in results():
+                    if stop.is_set():
+                        break
+                    publish((name, link))
+            except Exception as e:
+                logger.error(f"Error during {name} search: {e}")
+            finally:
+                publish((name, None))
+
+        for name, results in providers.items():
+            loop.run_in_executor(search_executor(), run, name, results)
 
-    def search_google(self, num_results: int = 5) -> list[str]:
-        """Searches links through DuckDuckGo and Google"""
+        running = set(providers)
+        deadline = loop.time() + timeout
+        seen = set()
+
+        async def next_link():
+            """Next new link that may be fetched, None once the providers are done or the time is up"""
+            while running:
+                try:
+                    name, link = await asyncio.wait_for(found.get(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    logger.warning(f"Search timed out, dropping {', '.join(sorted(running))}")
+                    return None
+                if link is None:
+                    running.discard(name)
+                elif link not in seen:
+                    seen.add(link)
+                    if self._allowed(link):
+                        return link
+            return None
+
+        async def collect_spares():
+            try:
+                while len(self._spare_links) < spare_results and (link := await next_link()) is not None:
+                    self._spare_links.append(link)
+            finally:
+                stop.set()
+
+        demoted = []
         try:
-            ddg_results = DDGS().text("ukraine "+self._found_prod_name, max_results=num_results)
-            for result in ddg_results:
-                self._links.append(result.get("href"))
-                # Extract site name from URL
-                site_name = self._extract_site_name(result.get("href"))
-                self._site_names.append(site_name)
-            
-        except Exception as e:
-            logger.error(f"Error during DuckDuckGo search: {e}")
-            
-        try:    
-            if len(self._links) < num_results:
-                google_links = list(search("review users "+self._found_prod_name, num_results=num_results))
-                for link in google_links:
-                    if link not in self._links:
-                        self._links.append(link)
-                        site_name = self._extract_site_name(link)
-                        self._site_names.append(site_name)
-        except Exception as e:
-            logger.error(f"Error during Google search: {e}")
-            
-        # Limit to the required number
-        self._links = self._links[:num_results]
-        self._site_names = self._site_names[:num_results]
+            while len(self._links) < num_results and (link := await next_link()) is not None:
+                if self._domain_health is not None and self._domain_health.demoted(link):
+                    demoted.append(link)
+                else:
+                    self._links.append(link)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            metrics.record_stage("search", time.perf_counter() - start)
+
+        # Fall back to the demoted links, keeping the rest as replacements
+        missing = num_results - len(self._links)
+        self._links += demoted[:missing]
+        self._spare_links = demoted[missing:]
+        self._site_names = [self._extract_site_name(link) for link in self._links]
+        if running and len(self._spare_links) < spare_results:
+            self._spare_search = asyncio.create_task(collect_spares())
+        else:
+            stop.set()
         return self._links
+
+    def _allowed(self, url: str) -> bool:
+        """Whether the url's domain may be fetched: its circuit is closed, or lets this link through as a trial"""
+        if self._domain_health is None or self._domain_health.allow(url):
+            return True
+        logger.info(f"Skipping {url}, the circuit of its domain is open")
+        metrics.record_domain_event("skipped")
+        return False
     
     def _extract_site_name(self, url: str) -> str:
         """Extract readable site name from URL"""
@@ -57,343 +205,462 @@ class ReviewFetcher:
         except Exception:
             return "Unknown Site"
 
-    async def extract_multiple_pages(self) -> tuple[list[str], list[str]]:
-        """Extract content from pages and return both content and site names"""
-        async with async_playwright() as p:
-            browser = await p.chromium.launch(headless=False)  # Changed to headless=True for production
-            page = await browser.new_page()
-            # Log browser errors
-            page.on("console", lambda msg: print(f"Browser Console: {msg.text}"))
-            page.on("pageerror", lambda error: print(f"Page Error: {error}"))
-            results = []
-            site_names = []
-            
-            for i, url in enumerate(self._links):
-                clear_content = ""
+    @property
+    def site_names(self) -> list[str]:
+        return self._site_names
+
+    @property
+    def links(self) -> list[str]:
+        """Links being fetched, with failed ones replaced by spare search results"""
+        return self._links
+
+    async def iter_pages(self, url_timeout: float = config.FETCH_URL_TIMEOUT,
+                         total_timeout: float = config.FETCH_TOTAL_TIMEOUT):
+        """Load pages concurrently and yield (index, site name, content, structured data) as each one finishes.
+
+        A page that fails is replaced by the next spare search result in the same
+        slot while there is time left before the overall deadline.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + total_timeout
+
+        def start(i):
+            timeout = min(url_timeout, deadline - loop.time())
+            return asyncio.create_task(asyncio.wait_for(self._extract_page(self._links[i], timeout), timeout))
+
+        tasks = {start(i): i for i in range(len(self._links))}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, timeout=max(0, deadline - loop.time()), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    break
+                for task in sorted(done, key=tasks.get):
+                    i = tasks[task]
+                    if task.exception() is not None and deadline - loop.time() > MIN_REFILL_SECONDS:
+                        self._record_outcome(i, task)
+                        if self._refill(i):
+                            replacement = start(i)
+                            tasks[replacement] = i
+                            pending.add(replacement)
+                            continue
+                        yield i, "Error Site", "", None
+                        continue
+                    yield self._page_result(i, task)
+        finally:
+            for task in pending:
+                task.cancel()
+            if self._spare_search is not None:
+                self._spare_search.cancel()
+        for task in sorted(pending, key=tasks.get):
+            yield self._page_result(tasks[task], None)
+
+    def _refill(self, i: int) -> bool:
+        """Put the next usable spare link into slot i"""
+        if self._domain_health is not None:
+            self._spare_links = self._domain_health.rank(self._spare_links)
+        while self._spare_links:
+            url = self._spare_links.pop(0)
+            # The link was allowed when it was found, skip it if its domain's circuit opened since
+            if self._domain_health is not None and self._domain_health.is_open(url):
+                logger.info(f"Skipping {url}, the circuit of its domain is open")
+                metrics.record_domain_event("skipped")
+                continue
+            logger.info(f"Replacing {self._links[i]} with {url}")
+            metrics.record_domain_event("refilled")
+            self._links[i] = url
+            self._site_names[i] = self._extract_site_name(url)
+            return True
+        return False
+
+    def _record_outcome(self, i: int, task: asyncio.Task | None) -> BaseException | str | None:
+        """Account a finished fetch task, or None if it missed the deadline, and return its error"""
+        url = self._links[i]
+        error = task.exception() if task is not None else "overall fetch deadline exceeded"
+        seconds, size, from_store = self._fetch_stats.get(url, (None, 0, False))
+        if error is not None:
+            logger.error(f"Error loading {url}: {error!r}")
+            if task is None:
+                outcome = "deadline"
+            elif isinstance(error, asyncio.TimeoutError):
+                outcome = "timeout"
+            else:
+                outcome = "error"
+        else:
+            outcome = "ok"
+        metrics.record_page(url, outcome, seconds, size)
+        # Only requests that reached the domain tell whether it is healthy
+        if self._domain_health is not None and not from_store:
+            self._domain_health.record_fetch(url, error is None, seconds)
+        return error
+
+    def _page_result(self, i: int, task: asyncio.Task | None) -> tuple[int, str, str, StructuredReview | None]:
+        """Turn a finished fetch task, or None if it missed the deadline, into a page result"""
+        if self._record_outcome(i, task) is not None:
+            return i, "Error Site", "", None
+        url = self._links[i]
+        site_name = self._site_names[i] if i < len(self._site_names) else self._extract_site_name(url)
+        return (i, site_name, *task.result())
+
+    async def _extract_page(self, url: str, timeout: float) -> tuple[str, StructuredReview | None]:
+        """Load one page and return its cleaned content and schema.org rating data.
+
+        A page in the page store is used as is while fresh, and revalidated with a
+        conditional request once stale. Otherwise a plain HTTP request is tried first;
+        the page is only rendered in the browser when the static HTML cannot be
+        fetched or has neither review content nor a structured rating of the product.
+        """
+        start = time.perf_counter()
+        stored = self._page_store.get(url) if self._page_store is not None else None
+        if stored is not None and self._page_store.is_fresh(stored):
+            metrics.record_page_store("fresh")
+            return await self._stored_result(url, start, stored, from_store=True)
+
+        static = await self._fetch_static(url, min(timeout, config.STATIC_FETCH_TIMEOUT), stored)
+        if static is not None and static.not_modified:
+            self._page_store.touch(url, static.etag, static.last_modified)
+            metrics.record_page_store("revalidated")
+            return await self._stored_result(url, start, stored)
+        if self._page_store is not None:
+            metrics.record_page_store("changed" if stored is not None else "miss")
+
+        if static is not None:
+            clear_content, structured = await self.read_page(static.html)
+            if self._has_review_content(clear_content) or structured is not None:
+                self._record_fetch(url, start, static.html)
+                await self._store_page(url, static.html, clear_content, static)
+                return clear_content, structured
+            logger.info(f"Static HTML of {url} lacks review content, rendering it in the browser")
+
+        remaining = max(1.0, timeout - (time.perf_counter() - start))
+        content = await self._fetch_rendered(url, remaining)
+        self._record_fetch(url, start, content)
+        clear_content, structured = await self.read_page(content)
+        await self._store_page(url, content, clear_content, static)
+        return clear_content, structured
+
+    async def _stored_result(self, url: str, start: float, stored: StoredPage,
+                             from_store: bool = False) -> tuple[str, StructuredReview | None]:
+        """Content of a page from the page store, nothing was downloaded; from_store if nothing was requested either"""
+        structured = await asyncio.to_thread(self._stored_structured_data, stored)
+        self._record_fetch(url, start, "", from_store)
+        return stored.markdown, structured
+
+    def _stored_structured_data(self, stored: StoredPage) -> StructuredReview | None:
+        """Rating of a stored page; its Markdown is kept, so the HTML is only parsed if it has schema.org data"""
+        html = stored.html
+        if not has_structured_data(html):
+            return None
+        return self._structured_data(parse_html(html))
+
+    async def _store_page(self, url: str, html: str, clear_content: str, static: StaticPage | None):
+        """Keep a fetched page with the validators of its static response, if there was one"""
+        if self._page_store is not None:
+            with metrics.stage("page_store"):
+                await asyncio.to_thread(self._page_store.put, url, html, clear_content,
+                                        static.etag if static else None, static.last_modified if static else None)
+
+    async def _fetch_static(self, url: str, timeout: float, stored: StoredPage | None = None) -> StaticPage | None:
+        """Fetch the page with the shared HTTP client, conditionally if it is stored; None if that did not work"""
+        if self._http_fetcher is None:
+            return None
+        try:
+            async with self._domain_slot(url):
+                with metrics.stage("fetch_http"):
+                    if stored is not None:
+                        return await self._http_fetcher.fetch(url, timeout, stored.etag, stored.last_modified)
+                    return await self._http_fetcher.fetch(url, timeout)
+        except Exception as e:
+            logger.info(f"Static fetch of {url} failed: {e!r}")
+            return None
+
+    async def _fetch_rendered(self, url: str, timeout: float) -> str:
+        """Render the page in a pooled browser context and return its HTML"""
+        from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+        async with self._domain_slot(url), self._browser_pool.page() as page:
+            with metrics.stage("fetch_browser"):
+                # Log browser errors
+                page.on("console", lambda msg: logger.debug(f"Browser console on {url}: {msg.text}"))
+                page.on("pageerror", lambda error: logger.debug(f"Page error on {url}: {error}"))
+                await page.goto(url, wait_until="domcontentloaded", timeout=timeout * 1000)
+                # Scroll page to load lazy content
+                await page.evaluate("""
+                    window.scrollTo({
+                        top: document.body.scrollHeight,
+                        behavior: 'smooth'
+                    });
+                """)
+                # Wait until the page has its text instead of sleeping a fixed time
                 try:
-                    await page.goto(url, wait_until="networkidle", timeout=30000)
-                    # Scroll page to load lazy content
-                    await page.evaluate("""
-                        window.scrollTo({
-                            top: document.body.scrollHeight,
-                            behavior: 'smooth'
-                        });
-                    """)
-                    await asyncio.sleep(2)
-                    content = await page.content()
-                    clear_content = await self.clear_information(content)
-                    results.append(clear_content[:3000])  # Increased limit for better context
-                    site_names.append(self._site_names[i] if i < len(self._site_names) else self._extract_site_name(url))
-                except Exception as e:
-                    logger.error(f"Error loading {url}: {e}")
-                    results.append("")
-                    site_names.append("Error Site")
-            await browser.close()
-            return results, site_names
-        
-    async def clear_information(self, content: str, chunk_size=480) -> str:
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # Save page title
-        title = soup.title.get_text() if soup.title else "No title"
-        
-        # Remove all scripts, styles and other unnecessary elements
-        for tag in soup.find_all(['script', 'style', 'iframe', 'noscript', 'svg', 'canvas']):
-            tag.decompose()  # Changed to decompose for better cleanup
-        
-        # Replace some tags with their text equivalents while preserving structure
-        for br in soup.find_all('br'):
-            br.replace_with('\n')
-        
-        for hr in soup.find_all('hr'):
-            hr.replace_with('\n---\n')
-        
-        # Process headings
-        for i in range(1, 7):
-            for h in soup.find_all(f'h{i}'):
-                h_text = h.get_text(strip=True)
-                h.replace_with(BeautifulSoup(f"\n{'#' * i} {h_text}\n", 'html.parser'))
-        
-        # Process paragraphs
-        for p in soup.find_all('p'):
-            p_text = p.get_text(strip=True)
-            p.replace_with(BeautifulSoup(f"\n{p_text}\n", 'html.parser'))
-        
-        # Process lists
-        for ul in soup.find_all('ul'):
-            new_content = "\n"
-            for li in ul.find_all('li', recursive=False):
-                new_content += f"* {li.get_text(strip=True)}\n"
-            ul.replace_with(BeautifulSoup(new_content, 'html.parser'))
-        
-        for ol in soup.find_all('ol'):
-            new_content = "\n"
-            for i, li in enumerate(ol.find_all('li', recursive=False), 1):
-                new_content += f"{i}. {li.get_text(strip=True)}\n"
-            ol.replace_with(BeautifulSoup(new_content, 'html.parser'))
-        
-        # Process tables (simplified)
-        for table in soup.find_all('table'):
-            new_content = "\n<TABLE>\n"
-            rows = table.find_all('tr')
-            for row in rows:
-                cells = row.find_all(['th', 'td'])
-                row_content = " | ".join([cell.get_text(strip=True) for cell in cells])
-                new_content += f"{row_content}\n"
-            new_content += "</TABLE>\n"
-            table.replace_with(BeautifulSoup(new_content, 'html.parser'))
-        
-        # Process links
-        for a in soup.find_all('a'):
-            if a.get('href') and a.get_text(strip=True):
-                a.replace_with(BeautifulSoup(f"[{a.get_text(strip=True)}]({a.get('href')})", 'html.parser'))
-        
-        # Process images
-        for img in soup.find_all('img'):
-            alt_text = img.get('alt', 'image')
-            src = img.get('src', '')
-            img.replace_with(BeautifulSoup(f"![{alt_text}]({src})", 'html.parser'))
-        
-        # Get cleaned text
-        cleaned_text = soup.get_text(separator='\n', strip=True)
-        
-        # Clean text from multiple line breaks and spaces
-        cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
-        cleaned_text = re.sub(r' {2,}', ' ', cleaned_text)
-        
-        # Add page title at the beginning
-        full_text = f"# {title}\n\n{cleaned_text}"
+                    await page.wait_for_function(
+                        CONTENT_READY_JS, arg=config.STATIC_MIN_CHARS,
+                        timeout=config.CONTENT_READY_TIMEOUT * 1000,
+                    )
+                except PlaywrightTimeoutError:
+                    logger.info(f"{url} was not ready after {config.CONTENT_READY_TIMEOUT}s, using it as is")
+                return await page.content()
+
+    def _domain_slot(self, url: str):
+        """Per-domain concurrency and rate limit around a request, if domain health is tracked"""
+        if self._domain_health is None:
+            return contextlib.nullcontext()
+        return self._domain_health.slot(url)
+
+    def _has_review_content(self, clear_content: str) -> bool:
+        """Whether the cleaned page is long enough and mentions the product"""
+        if len(clear_content) < config.STATIC_MIN_CHARS:
+            return False
+        text = clear_content.lower()
+        terms = set(re.findall(r'\w+', self._found_prod_name.lower()))
+        found = sum(1 for term in terms if term in text)
+        return found * 2 >= len(terms)
+
+    def _record_fetch(self, url: str, start: float, content: str, from_store: bool = False):
+        seconds = time.perf_counter() - start
+        self._fetch_stats[url] = (seconds, len(content.encode("utf-8")), from_store)
+        metrics.record_stage("fetch", seconds)
         
-        return full_text
+    async def read_page(self, content: str) -> tuple[str, StructuredReview | None]:
+        """Convert page HTML to Markdown-like text and read its schema.org rating, from one parse in a worker thread"""
+        return await asyncio.to_thread(self._read_page, content)
+
+    def _read_page(self, content: str) -> tuple[str, StructuredReview | None]:
+        with metrics.stage("clean"):
+            root = parse_html(content)
+            clear_content = tree_to_markdown(root)
+        return clear_content, self._structured_data(root)
+
+    def _structured_data(self, root) -> StructuredReview | None:
+        """Read the product rating a parsed page publishes as JSON-LD or microdata"""
+        with metrics.stage("structured_data"):
+            try:
+                structured = extract_structured_data(root, self._found_prod_name)
+            except Exception as e:
+                logger.warning(f"Could not read structured data: {e!r}")
+                return None
+        if structured is not None:
+            logger.info(f"Found {structured.source} rating {structured.rating_text} of {self._found_prod_name}")
+        return structured
 
 
 class ProductDescription:
     def __init__(self):
         self.site_names = []
-        self.ratings = []
-        self.pros = []
-        self.cons = []
+        self.ratings: list[float | None] = []
+        self.scales: list[float] = []
+        self.pros: list[list[str]] = []
+        self.cons: list[list[str]] = []
         self.similar_products = {}
-        
+
+    def resize(self, count: int):
+        """Start with no data for each of count sites"""
+        self.ratings = [None] * count
+        self.scales = [10.0] * count
+        self.pros = [[] for _ in range(count)]
+        self.cons = [[] for _ in range(count)]
+
+    def set_site(self, i: int, rating: float | None, scale: float, pros: list[str], cons: list[str]):
+        self.ratings[i] = rating
+        self.scales[i] = scale
+        self.pros[i] = pros
+        self.cons[i] = cons
+
     def calculate_average_rating(self):
-        """Calculate average rating from all numerical ratings"""
-        valid_ratings = []
-        for rating in self.ratings:
-            try:
-                # Try to extract numeric values with regex
-                match = re.search(r'(\d+(\.\d+)?)', rating)
-                if match:
-                    valid_ratings.append(float(match.group(1)))
-            except (ValueError, AttributeError):
-                continue
-                
+        """Calculate average rating of all sites, on a scale of 10"""
+        valid_ratings = [rating * 10 / scale for rating, scale in zip(self.ratings, self.scales)
+                         if rating is not None and scale]
         if not valid_ratings:
             return None
         return sum(valid_ratings) / len(valid_ratings)
-    
+
+    def rating_text(self, i: int) -> str:
+        rating = self.ratings[i] if i < len(self.ratings) else None
+        return f"{rating:g}/{self.scales[i]:g}" if rating is not None else "No data"
+
     def as_dict(self):
         """Return data as dictionary for easier access in templates"""
-        result = []
-        for i in range(len(self.site_names)):
-            site_data = {
-                "site_name": self.site_names[i] if i < len(self.site_names) else "Unknown",
-                "rating": self.ratings[i] if i < len(self.ratings) else "No data",
-                "pros": self.pros[i] if i < len(self.pros) else "No data",
-                "cons": self.cons[i] if i < len(self.cons) else "No data"
-            }
-            result.append(site_data)
-        return result
-    
+        return [self.site_as_dict(i) for i in range(len(self.site_names))]
+
+    def has_data(self, i: int) -> bool:
+        """Whether anything was found for the site"""
+        return any(values[i] if i < len(values) else None for values in (self.ratings, self.pros, self.cons))
+
+    def site_as_dict(self, i: int) -> dict:
+        """Return the data of one site"""
+        return {
+            "site_name": self.site_names[i] if i < len(self.site_names) else "Unknown",
+            "rating": self.rating_text(i),
+            "pros": self._as_bullets(self.pros[i] if i < len(self.pros) else []),
+            "cons": self._as_bullets(self.cons[i] if i < len(self.cons) else []),
+        }
+
+    @staticmethod
+    def _as_bullets(items: list[str]) -> str:
+        return "\n".join(f"* {item}" for item in items) if items else "No data"
+
+
 class ReviewAnalyzer:
     """Class for analyzing product review information"""
-    def __init__(self, query: str, sites_content: list[str], site_names: list[str]):
+    def __init__(self, query: str, sites_content: list[str], site_names: list[str], llm=None,
+                 structured_data: list[StructuredReview | None] | None = None, tokenizer=None):
         self._found_prod_name = query.strip()
+        self._llm = llm
+        self._tokenizer = tokenizer or llm
         self._lock = asyncio.Lock()
         self._description = ProductDescription()
         self.sites_content = sites_content
         self.site_names = site_names
+        self.structured_data = structured_data or [None] * len(site_names)
         self._description.site_names = site_names
+        self._description.resize(len(site_names))
+
+    @property
+    def description(self) -> ProductDescription:
+        return self._description
 
     def analyze_product(self) -> ProductDescription:
         """Analyzes product information from multiple sites"""
-        
+        for index, content in enumerate(self.sites_content):
+            self.analyze_site(index, content, structured=self.structured_data[index])
+        return self._description
 
+    def analyze_site(self, index: int, content: str, site_name: str | None = None,
+                     structured: StructuredReview | None = None, llm=None) -> dict:
+        """Analyzes one site and returns its part of the product description"""
+        prompt = self.prepare_site(index, content, site_name, structured)
+        return self.finish_site(index, prompt, llm)
 
-        for num, content in enumerate(self.sites_content, start=1):
-            if not content.strip():
-                self._description.ratings.append("No data")
-                self._description.pros.append("No data")
-                self._description.cons.append("No data")
-                continue
+    def prepare_site(self, index: int, content: str, site_name: str | None = None,
+                     structured: StructuredReview | None = None) -> str | None:
+        """Record what is known about a site and build the prompt asking for the rest.
+
+        Whatever the page publishes as schema.org data is taken as is; None is
+        returned when that leaves nothing to ask the model. Sites may be prepared
+        and finished at the same time from several threads.
+        """
+        if site_name is not None:
+            self.site_names[index] = site_name
+        self.sites_content[index] = content
+        self.structured_data[index] = structured
+        if structured is not None:
+            self._description.set_site(index, structured.rating, structured.best_rating,
+                                       structured.pros, structured.cons)
+        else:
+            self._description.set_site(index, None, 10.0, [], [])
+        missing = (self._description.ratings[index] is None or not self._description.pros[index]
+                   or not self._description.cons[index])
+        if not content.strip() or not missing:
+            return None
+        # Send only the parts of the page most relevant to the product
+        with metrics.stage("select_chunks"):
+            content = select_chunks(content, self._found_prod_name, self._count_tokens,
+                                    config.CONTENT_TOKEN_BUDGET, config.CHUNK_SIZE)
+        if self._needs_rating(index):
+            question = (
+                f"Extract the rating of '{self._found_prod_name}' with the scale it is given on, "
+                f"and its PROS and CONS, from the information above. "
+                f"Use null for a missing rating and empty lists for missing pros or cons, "
+            )
+        else:
+            # The page publishes the rating, only ask for what it lacks
+            question = (
+                f"Extract the PROS and CONS of '{self._found_prod_name}' from the information above. "
+                f"Use empty lists for missing pros or cons, "
+            )
+        return (
+            f"<CONTENT INFORMATION>: <<\n{content}\n>>\n"
+            f"<QUESTION>:You are an expert in analyzing product reviews. {question}"
+            f"or if the information does not match the product. Keep each item short. Answer in JSON.\n"
+        )
 
+    def finish_site(self, index: int, prompt: str | None, llm=None) -> dict:
+        """Ask the model the prompt from prepare_site, if any, and return the site's part of the description"""
+        if prompt is not None:
+            llm = llm or self._llm
             try:
-                llm = Llama(
-                    model_path="../models/gemma-2-2b-it.Q8_0.gguf",
-                    n_ctx=16384,
-                    )
-                # Extract rating
-                content_multiline = content.split('\n')
-                prompt = (
-                f"<QUESTION>:You are an expert in analyzing product reviews. "
-                f"Extract only the rating of '{self._found_prod_name}' from the information below. "
-                f"If the rating is missing or does not match the product, return 'no data'"
-                f"Answer format If a rating is found: 'Rating: X.X'\n"
-                f"Be concise and specific. Don't add explanations."
-                f"<CONTENT INFORMATION>: <<\n{content_multiline}\n>>"
-                )
-                
-                response = llm(
-                    prompt,
-                    max_tokens=250,
-                    temperature=0.1,
-                    top_p=0.1,
-                    stop=["<QUESTION>", "<CONTENT INFORMATION>"])
-                rating = re.sub(r'^Rating:\s*', '', response["choices"][0]["text"].strip())
-
-                self._description.ratings.append(rating)
-                llm.reset()
-                # Extract pros
-                prompt = (
-                f"<QUESTION>:You are an expert in analyzing product reviews. "
-                f"Extract only the PROS of '{self._found_prod_name}' from the content below. "
-                f"If the needed information is missing or does not match the product, return 'no data'"
-                f"Be concise and specific. Don't add explanations.\n\n"
-                f"<CONTENT INFORMATION>: <<\n{content_multiline}\n>>"
-                )
-                response = llm(
-                    prompt,
-                    max_tokens=250,
-                    temperature=0.7,
-                    top_p=0.3,
-                    stop=["<QUESTION>", "<CONTENT INFORMATION>"]
-                )
-                result = response["choices"][0]["text"].strip()
-                llm.reset()
-                # Make sure the result has proper bullet points
-                if not result.startswith("*"):
-                    lines = result.split("\n")
-                    result = "\n".join([f"* {line.strip('- ')}" for line in lines if line.strip()])
-                pros = result
-                self._description.pros.append(pros)
-                # Extract cons
-                prompt = (
-                f"<QUESTION>:You are an expert in analyzing product reviews. "
-                f"Extract only the CONS of '{self._found_prod_name}' from the content below. "
-                f"If the needed information is missing or does not match the product, return 'no data'"
-                f"Be concise and specific. Don't add explanations.\n\n"
-                f"<CONTENT INFORMATION>:<<\n{content_multiline}\n>>"
-                )
-                response = llm(
-                    prompt,
-                    max_tokens=250,
-                    temperature=0.7,
-                    top_p=0.3,
-                    stop=["<QUESTION>", "<CONTENT INFORMATION>"]
-                )
-                result = response["choices"][0]["text"].strip()
-                # Make sure the result has proper bullet points
-                if not result.startswith("*"):
-                    lines = result.split("\n")
-                    result = "\n".join([f"* {line.strip('- ')}" for line in lines if line.strip()])
-                cons = result
-                self._description.cons.append(cons)
+                review = self._extract_review(prompt, llm, with_rating=self._needs_rating(index))
             finally:
                 llm.reset()
-                llm.close()
-            
-            print(f"Site {self.site_names[num-1]} analysis:")
-            print(f"Rating: {rating}")
-            print(f"Pros: {pros}")
-            print(f"Cons: {cons}")
-            print("-" * 40)
-            
-        return self._description
-    
-    def _extract_rating(self, content: str, num: int) -> str:
-        """Extract product rating from content"""
-        prompt = (
-            f"<QUESTION>:You are an expert in analyzing product reviews. "
-            f"Extract only the rating of '{self._found_prod_name}' from the information below. "
-            f"If the rating is missing or does not match the product, return 'no data'"
-            f"Answer format If a rating is found: 'Rating: X.X'\n"
-            f"Be concise and specific. Don't add explanations."
-            f"<CONTENT INFORMATION>: <<\n{content}\n>>"
-        )
-    
-        self._llm.reset()
-        response = self._llm(
-            prompt,
-            max_tokens=50,
-            temperature=0.1,
-            top_p=0.1,
-            stop=["<QUESTION>", "<CONTENT INFORMATION>"]
-        )
-        result = response["choices"][0]["text"].strip()
-        # Clean up common issues in responses
-        result = re.sub(r'^Rating:\s*', '', result)
-    
-        return result
-    
-    def _extract_pros(self, content: str, num: int) -> str:
-        """Extract product pros from content"""
-
-        prompt = (
-            f"<QUESTION>:You are an expert in analyzing product reviews. "
-            f"Extract only the PROS of '{self._found_prod_name}' from the content below. "
-            f"If the needed information is missing or does not match the product, return 'no data'"
-            f"Be concise and specific. Don't add explanations.\n\n"
-            f"<CONTENT INFORMATION>: <<\n{content}\n>>"
-        )
-        self._llm.reset()
-        response = self._llm(
-            prompt,
-            max_tokens=250,
-            temperature=0.1,
-            top_p=0.1,
-            stop=None
-        )
-        result = response["choices"][0]["text"].strip()
-        if not result or "no" in result.lower() and "found" in result.lower():
-            return "No advantages found"
-        self._llm.reset()
-    # Make sure the result has proper bullet points
-        if not result.startswith("*"):
-            lines = result.split("\n")
-            result = "\n".join([f"* {line.strip('- ')}" for line in lines if line.strip()])
-        
-        return result
-    
-    def _extract_cons(self, content: str, num: int) -> str:
-        """Extract product cons from content"""
-        prompt = (
-            f"<QUESTION>:You are an expert in analyzing product reviews. "
-            f"Extract only the CONS of '{self._found_prod_name}' from the content below. "
-            f"If the needed information is missing or does not match the product, return 'no data'"
-            f"Be concise and specific. Don't add explanations.\n\n"
-            f"<CONTENT INFORMATION>:<<\n{content}\n>>"
+            description = self._description
+            if description.ratings[index] is None and review["rating"] is not None:
+                description.ratings[index], description.scales[index] = review["rating"], review["scale"]
+            description.pros[index] = description.pros[index] or review["pros"]
+            description.cons[index] = description.cons[index] or review["cons"]
+
+        logger.debug(f"Site {self.site_names[index]} analysis: rating {self._description.rating_text(index)}, "
+                     f"pros {self._description.pros[index]}, cons {self._description.cons[index]}")
+
+        return self._description.site_as_dict(index)
+
+    def context_tokens(self, prompt: str, max_tokens: int) -> int:
+        """Context size a prompt needs, including room for the answer"""
+        return len(self._tokenizer.tokenize(prompt.encode("utf-8"), special=True)) + max_tokens
+
+    def _count_tokens(self, text: str) -> int:
+        return len(self._tokenizer.tokenize(text.encode("utf-8"), add_bos=False))
+
+    def _complete(self, llm, prompt: str, **params) -> str:
+        """Stream a completion and return its text, timing prompt evaluation apart from generation.
+
+        The first chunk arrives once the prompt is evaluated and the first token
+        sampled; everything after it is token generation.
+        """
+        start = time.perf_counter()
+        first = None
+        pieces = []
+        for chunk in llm(prompt, stream=True, **params):
+            if first is None:
+                first = time.perf_counter()
+            pieces.append(chunk["choices"][0]["text"])
+        end = time.perf_counter()
+        first = first or end
+        text = "".join(pieces)
+        metrics.record_stage("generate", end - start)
+        metrics.record_stage("prompt_eval", first - start)
+        metrics.record_tokens(
+            prompt=len(self._tokenizer.tokenize(prompt.encode("utf-8"), special=True)),
+            completion=self._count_tokens(text),
+            prompt_seconds=first - start,
+            generation_seconds=end - first,
         )
-        self._llm.reset()
-    
-        response = self._llm(
+        return text
+
+    def _needs_rating(self, index: int) -> bool:
+        """Whether the site's rating is still to be extracted by the model"""
+        return self._description.ratings[index] is None
+
+    def _extract_review(self, prompt: str, llm, with_rating: bool = True) -> dict:
+        """Extract rating, pros and cons in one generation constrained to REVIEW_SCHEMA, or NOTES_SCHEMA if the rating is known"""
+        text = self._complete(
+            llm,
             prompt,
-            max_tokens=250,
-            temperature=0.1,
-            top_p=0.1,
-            stop=None
+            grammar=review_grammar(with_rating),
+            max_tokens=REVIEW_MAX_TOKENS,
+            temperature=0.2,
+            top_p=0.3,
         )
-        result = response["choices"][0]["text"].strip()
-        if not result or "no" in result.lower() and "found" in result.lower():
-            return "No disadvantages found"
-        
-    # Make sure the result has proper bullet points
-        if not result.startswith("*"):
-            lines = result.split("\n")
-            result = "\n".join([f"* {line.strip('- ')}" for line in lines if line.strip()])
-        
-        return result
-    
-    def generate_summary(self) -> str:
+        return self._parse_review(text)
+
+    def _parse_review(self, text: str) -> dict:
+        """Read the extracted JSON; the grammar guarantees its shape unless the output was cut off"""
+        review = {"rating": None, "scale": 10.0, "pros": [], "cons": []}
+        try:
+            data = json.loads(text)
+        except ValueError:
+            logger.warning(f"Unreadable review extraction for {self._found_prod_name}: {text!r}")
+            return review
+        rating, scale = data.get("rating"), data.get("scale")
+        if isinstance(rating, (int, float)) and isinstance(scale, (int, float)) and 0 <= rating <= scale:
+            review["rating"], review["scale"] = float(rating), float(scale)
+        for key in ("pros", "cons"):
+            review[key] = [item.strip() for item in data.get(key) or [] if isinstance(item, str) and item.strip()]
+        return review
+
+    def generate_summary(self, llm=None) -> str:
         """Generate a summary of all findings"""
+        llm = llm or self._llm
         avg_rating = self._description.calculate_average_rating()
         rating_text = f"{avg_rating:.1f}/10" if avg_rating else "Unknown"
         
@@ -406,33 +673,43 @@ class ReviewAnalyzer:
         
         for i in range(len(self._description.site_names)):
             site = self._description.site_names[i]
-            rating = self._description.ratings[i].replace("\n", " ")
+            rating = self._description.rating_text(i)
             
             # Format pros and cons for table
-            pros = self._description.pros[i].replace("\n", "<br>").replace("* ", "✓ ")
-            cons = self._description.cons[i].replace("\n", "<br>").replace("* ", "✗ ")
+            pros = "<br>".join(f"✓ {pro}" for pro in self._description.pros[i]) or "No data"
+            cons = "<br>".join(f"✗ {con}" for con in self._description.cons[i]) or "No data"
             
             table += f"| {site} | {rating} | {pros} | {cons} |\n"
         
         # Add a conclusion section
         table += "\n## Conclusion\n\n"
         
+        llm.reset()
+        start = time.perf_counter()
+        conclusion = self._complete(
+            llm,
+            self.summary_prompt(),
+            max_tokens=SUMMARY_MAX_TOKENS,
+            temperature=0.7,
+            top_p=0.5
+        ).strip()
+        metrics.record_stage("summary", time.perf_counter() - start)
+        table += conclusion
+        
+        return table
+
+    def summary_prompt(self) -> str:
+        """Prompt asking the model for the conclusion of the summary"""
+        avg_rating = self._description.calculate_average_rating()
+        rating_text = f"{avg_rating:.1f}/10" if avg_rating else "Unknown"
         conclusion_prompt = (
             f"Based on the following product analysis for '{self._found_prod_name}', write a 3-4 sentence conclusion. "
             f"Average Rating: {rating_text}\n"
         )
         
         # Add some pros and cons to the conclusion prompt
-        all_pros = []
-        all_cons = []
-        for i in range(len(self._description.pros)):
-            if "No " not in self._description.pros[i]:
-                pros_lines = self._description.pros[i].split("\n")
-                all_pros.extend([line.strip("* ") for line in pros_lines if line.strip()])
-            
-            if "No " not in self._description.cons[i]:
-                cons_lines = self._description.cons[i].split("\n")
-                all_cons.extend([line.strip("* ") for line in cons_lines if line.strip()])
+        all_pros = [pro for pros in self._description.pros for pro in pros]
+        all_cons = [con for cons in self._description.cons for con in cons]
         
         # Take the top 5 most mentioned pros and cons
         conclusion_prompt += "Pros:\n"
@@ -442,15 +719,4 @@ class ReviewAnalyzer:
         conclusion_prompt += "Cons:\n"
         for con in all_cons[:5]:
             conclusion_prompt += f"- {con}\n"
-        
-        conclusion_response = self._llm(
-            conclusion_prompt,
-            max_tokens=250,
-            temperature=0.7,
-            top_p=0.5
-        )
-        
-        conclusion = conclusion_response["choices"][0]["text"].strip()
-        table += conclusion
-        
-        return table
\ No newline at end of file
+        return conclusion_prompt
\ No newline at end of file
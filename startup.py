@@ -0,0 +1,97 @@
+import asyncio
+import time
+from contextlib import contextmanager
+
+import metrics
+import services
+from logger_config import logger
+
+
+class Startup:
+    """Warm-up phases of the application, how long each took and whether the instance is ready"""
+    def __init__(self):
+        self.phases = {}
+        self.error = None
+        self._started = time.perf_counter()
+        self._seconds = None
+        self._done = asyncio.Event()
+
+    @property
+    def status(self) -> str:
+        if not self._done.is_set():
+            return "starting"
+        return "failed" if self.error is not None else "ready"
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    @property
+    def failed(self) -> bool:
+        return self.status == "failed"
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time a startup phase"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = seconds
+            metrics.record_startup(name, seconds)
+            logger.info(f"Startup phase {name} took {seconds:.2f}s")
+
+    def finish(self, error: BaseException | None = None):
+        self.error = error
+        self._seconds = time.perf_counter() - self._started
+        metrics.record_startup("total", self._seconds)
+        self._done.set()
+
+    async def wait(self):
+        """Wait until the instance is warm, raising if the warm-up failed"""
+        await self._done.wait()
+        if self.error is not None:
+            raise RuntimeError(f"Startup failed: {self.error}")
+
+    def as_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "seconds": self._seconds if self._seconds is not None else time.perf_counter() - self._started,
+            "phases": self.phases,
+            "error": str(self.error) if self.error is not None else None,
+        }
+
+
+async def warm_up(state):
+    """Load and exercise the model, start the browser and import the search clients, all at once.
+
+    Marks state.startup as ready when everything is warm, or as failed with the
+    first error.
+    """
+    startup = state.startup
+
+    async def model():
+        with startup.phase("model_load"):
+            await asyncio.to_thread(state.model_pool.load)
+        with startup.phase("model_warmup"):
+            await asyncio.to_thread(state.model_pool.warm_up)
+            await asyncio.to_thread(services.review_grammar)
+            await asyncio.to_thread(services.review_grammar, False)
+
+    async def browser():
+        with startup.phase("browser_start"):
+            await state.browser_pool.start()
+
+    async def search():
+        with startup.phase("search_import"):
+            await asyncio.to_thread(services.search_providers)
+
+    try:
+        await asyncio.gather(model(), browser(), search())
+    except Exception as e:
+        logger.error(f"Startup failed: {e!r}")
+        startup.finish(e)
+        return
+    startup.finish()
+    logger.info(f"Ready after {startup.as_dict()['seconds']:.2f}s")
@@ -0,0 +1,177 @@
+import json
+import re
+
+DEFAULT_BEST_RATING = 5.0
+
+
+class StructuredReview:
+    """Rating and pros/cons a page publishes as schema.org data"""
+    def __init__(self, rating: float | None = None, best_rating: float = DEFAULT_BEST_RATING,
+                 review_count: int | None = None, pros: list[str] | None = None,
+                 cons: list[str] | None = None, source: str = ""):
+        self.rating = rating
+        self.best_rating = best_rating
+        self.review_count = review_count
+        self.pros = pros or []
+        self.cons = cons or []
+        self.source = source
+
+    @property
+    def rating_text(self) -> str:
+        """Rating with its scale, e.g. '4.5/5'"""
+        return f"{self.rating:g}/{self.best_rating:g}"
+
+
+def _terms(text: str) -> set[str]:
+    return set(re.findall(r'\w+', text.lower()))
+
+
+def _number(value) -> float | None:
+    if isinstance(value, dict):
+        value = value.get("@value")
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        match = re.search(r'\d+(?:[.,]\d+)?', value)
+        if match:
+            return float(match.group().replace(',', '.'))
+    return None
+
+
+def _types(node: dict) -> set[str]:
+    types = node.get("@type", [])
+    if isinstance(types, str):
+        types = [types]
+    return {str(value).rsplit('/', 1)[-1] for value in types}
+
+
+def _name(node) -> str | None:
+    if isinstance(node, dict):
+        name = node.get("name")
+        return name if isinstance(name, str) else None
+    return None
+
+
+def _notes(notes) -> list[str]:
+    """Texts of a schema.org positiveNotes/negativeNotes ItemList"""
+    if isinstance(notes, dict):
+        notes = notes.get("itemListElement", [])
+    if not isinstance(notes, list):
+        notes = [notes]
+    texts = []
+    for note in notes:
+        text = note if isinstance(note, str) else _name(note)
+        if text and text.strip():
+            texts.append(text.strip())
+    return texts
+
+
+def _walk(node):
+    if isinstance(node, dict):
+        yield node
+        for value in node.values():
+            yield from _walk(value)
+    elif isinstance(node, list):
+        for value in node:
+            yield from _walk(value)
+
+
+def _json_ld_candidates(root) -> list[tuple[str | None, StructuredReview]]:
+    """(item name, review) pairs for every rating found in JSON-LD blocks"""
+    candidates = []
+    for script in root.xpath('//script[@type="application/ld+json"]'):
+        try:
+            data = json.loads(script.text or "")
+        except ValueError:
+            continue
+        for node in _walk(data):
+            types = _types(node)
+            if isinstance(node.get("aggregateRating"), dict):
+                rating = node["aggregateRating"]
+                owner = _name(node)
+                source = "json-ld AggregateRating"
+            elif "Review" in types and isinstance(node.get("reviewRating"), dict):
+                rating = node["reviewRating"]
+                owner = _name(node.get("itemReviewed")) or _name(node)
+                source = "json-ld Review"
+            elif "AggregateRating" in types and "itemReviewed" in node:
+                rating = node
+                owner = _name(node.get("itemReviewed"))
+                source = "json-ld AggregateRating"
+            else:
+                continue
+            review = StructuredReview(
+                rating=_number(rating.get("ratingValue")),
+                best_rating=_number(rating.get("bestRating")) or DEFAULT_BEST_RATING,
+                review_count=_int(rating.get("reviewCount") or rating.get("ratingCount")),
+                pros=_notes(node.get("positiveNotes")),
+                cons=_notes(node.get("negativeNotes")),
+                source=source,
+            )
+            candidates.append((owner, review))
+    return candidates
+
+
+def _int(value) -> int | None:
+    number = _number(value)
+    return int(number) if number is not None else None
+
+
+def _itemprop_value(element) -> str:
+    return element.get("content") or element.text_content().strip()
+
+
+def _microdata_candidates(root) -> list[tuple[str | None, StructuredReview]]:
+    """(item name, review) pairs for every rating found in microdata"""
+    candidates = []
+    for rating in root.xpath('//*[@itemprop="aggregateRating" or @itemprop="reviewRating"]'):
+        values = {}
+        for prop in rating.xpath('.//*[@itemprop]'):
+            values.setdefault(prop.get("itemprop"), _itemprop_value(prop))
+        owner_scope = next((ancestor for ancestor in rating.iterancestors()
+                            if ancestor.get("itemscope") is not None), None)
+        owner = None
+        if owner_scope is not None:
+            names = owner_scope.xpath('.//*[@itemprop="name"]')
+            owner = _itemprop_value(names[0]) if names else None
+        candidates.append((owner, StructuredReview(
+            rating=_number(values.get("ratingValue")),
+            best_rating=_number(values.get("bestRating")) or DEFAULT_BEST_RATING,
+            review_count=_int(values.get("reviewCount") or values.get("ratingCount")),
+            source=f"microdata {rating.get('itemprop')}",
+        )))
+    return candidates
+
+
+def has_structured_data(content: str) -> bool:
+    """Whether page HTML has any JSON-LD or microdata, checked without parsing it"""
+    return "ld+json" in content or "itemprop" in content
+
+
+def extract_structured_data(root, product_name: str) -> StructuredReview | None:
+    """Find a trustworthy schema.org rating of the product in a page parsed with markdown_converter.parse_html.
+
+    A rating is trusted when it lies within its scale and belongs to an item whose
+    name matches the product; an unnamed rating is only trusted when it is the only
+    one on the page.
+    """
+    if root is None:
+        return None
+
+    candidates = [(owner, review) for owner, review in _json_ld_candidates(root) + _microdata_candidates(root)
+                  if review.rating is not None and 0 <= review.rating <= review.best_rating]
+    product_terms = _terms(product_name)
+    trusted = []
+    for owner, review in candidates:
+        if owner is None:
+            if len(candidates) == 1:
+                trusted.append(review)
+        elif len(product_terms & _terms(owner)) * 2 >= len(product_terms):
+            trusted.append(review)
+    if not trusted:
+        return None
+    # Prefer the rating backed by the most reviews, with notes from any review of the product
+    best = max(trusted, key=lambda review: review.review_count or 0)
+    best.pros = best.pros or next((review.pros for review in trusted if review.pros), [])
+    best.cons = best.cons or next((review.cons for review in trusted if review.cons), [])
+    return best
@@ -0,0 +1,40 @@
+import time
+
+from domain_health import DomainHealth
+
+
+def test_half_open_circuit_lets_a_single_trial_through():
+    health = DomainHealth(failure_threshold=2, open_seconds=60, probe_seconds=30)
+    for _ in range(2):
+        health.record_fetch("https://shop.example/a", ok=False)
+    assert not health.allow("https://shop.example/b")
+
+    # Once the circuit is due to close, only the first link is let through
+    health._stats("https://shop.example/a").open_until = time.time() - 1
+    assert health.allow("https://shop.example/b")
+    assert not health.allow("https://www.shop.example/c")
+    assert not health.is_open("https://shop.example/b")
+    assert health.as_dict()["shop.example"]["probing"]
+
+    # A failed trial opens the circuit again right away
+    health.record_fetch("https://shop.example/b", ok=False)
+    assert health.is_open("https://shop.example/c")
+    assert not health.allow("https://shop.example/c")
+
+    # A successful trial closes it
+    health._stats("https://shop.example/a").open_until = time.time() - 1
+    assert health.allow("https://shop.example/c")
+    health.record_fetch("https://shop.example/c", ok=True)
+    assert health.allow("https://shop.example/d")
+    assert health.allow("https://shop.example/e")
+
+
+def test_unrecorded_trial_expires():
+    health = DomainHealth(failure_threshold=1, open_seconds=60, probe_seconds=30)
+    health.record_fetch("https://shop.example/a", ok=False)
+    stats = health._stats("https://shop.example/a")
+    stats.open_until = time.time() - 1
+    assert health.allow("https://shop.example/b")
+    assert not health.allow("https://shop.example/c")
+    stats.probe_until = time.time() - 1
+    assert health.allow("https://shop.example/c")
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from http_fetcher import HttpFetcher
+
+CHUNK = b"x" * 65536
+PAGE = "<html><body><p>Привіт</p></body></html>".encode("cp1251")
+# The charset is only declared in the page itself
+META_PAGE = '<html><head><meta charset="windows-1251"></head><body><p>Відгуки</p></body></html>'.encode("cp1251")
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    sent = {}
+
+    def do_GET(self):
+        if self.path in ("/page", "/meta"):
+            body = PAGE if self.path == "/page" else META_PAGE
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=windows-1251" if self.path == "/page" else "text/html")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf" if self.path == "/pdf" else "text/html")
+        if self.path == "/pdf":
+            self.send_header("Content-Length", str(len(CHUNK) * 1000))
+        self.send_header("Connection", "close")
+        self.end_headers()
+        # A 64 MB body, written until the client hangs up
+        self.sent[self.path] = 0
+        try:
+            for _ in range(1000):
+                self.wfile.write(CHUNK)
+                self.sent[self.path] += len(CHUNK)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def test_rejects_on_headers_and_caps_the_body():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    async def main():
+        fetcher = HttpFetcher(max_page_bytes=2 ** 20)
+        try:
+            return [await fetcher.fetch(f"{base}/{path}", timeout=10) for path in ("page", "meta", "pdf", "huge")]
+        finally:
+            await fetcher.close()
+
+    try:
+        page, meta, pdf, huge = asyncio.run(main())
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert "Привіт" in page.html
+    assert "Відгуки" in meta.html
+    assert pdf is None
+    assert huge is None
+    # Neither body was transferred in full
+    assert all(sent < len(CHUNK) * 1000 for sent in Handler.sent.values())
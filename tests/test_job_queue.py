@@ -0,0 +1,33 @@
+import asyncio
+
+from job_queue import JobQueue
+
+
+def test_jobs_with_the_same_key_are_shared_and_streamed():
+    runs = []
+
+    async def run_job(job):
+        runs.append(job.product_name)
+        job.apply({"event": "search", "sites": []})
+        await asyncio.sleep(0.05)
+        job.apply({"event": "summary", "product_info": [], "summary": "done"})
+
+    async def collect(job, delay):
+        await asyncio.sleep(delay)
+        return [event["event"] async for event in job.stream()]
+
+    async def main():
+        queue = JobQueue(run_job, workers=2)
+        queue.start()
+        first = queue.submit("Phone", key="phone")
+        second = queue.submit("phone", key="phone")
+        other = queue.submit("Phone", use_cache=False)
+        # A stream joining after the first event still gets every event
+        streams = await asyncio.gather(collect(first, 0), collect(second, 0.02), collect(other, 0))
+        await queue.stop()
+        return first, second, streams
+
+    first, second, streams = asyncio.run(main())
+    assert first is second
+    assert sorted(runs) == ["Phone", "Phone"]
+    assert streams == [["search", "summary"]] * 3
@@ -0,0 +1,29 @@
+from pathlib import Path
+
+from markdown_converter import html_to_markdown
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_matches_previous_cleaner_on_fixture():
+    content = (ROOT / "content.txt").read_text(encoding="utf-8")
+    # Output of the BeautifulSoup cleaner that html_to_markdown replaced, on content.txt
+    reference = (ROOT / "clear_content.txt").read_text(encoding="utf-8")
+    # The previous cleaner's default alt text for images was Russian
+    assert reference.count("![изображение](") == 1
+    reference = reference.replace("![изображение](", "![image](")
+    # The fixture ends with a separator after </html>; libxml2 drops it, a browser DOM never has it
+    separator = "\n-----------------\n"
+    assert reference.endswith(separator)
+    assert html_to_markdown(content) == reference.removesuffix(separator)
+
+
+def test_tables_keep_their_markers():
+    # The previous cleaner reparsed "<TABLE>" as a tag and lost it, giving "# No title\n\nA | B\n1 | 2"
+    content = "<table><tr><th>A</th><th>B</th></tr><tr><td>1</td><td>2</td></tr></table>"
+    assert html_to_markdown(content) == "# No title\n\n<TABLE>\nA | B\n1 | 2\n</TABLE>"
+
+
+def test_empty_documents():
+    assert html_to_markdown("") == "# No title\n\n"
+    assert html_to_markdown("<!-- x -->") == "# No title\n\n"
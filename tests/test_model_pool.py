@@ -0,0 +1,131 @@
+import asyncio
+import sys
+import threading
+import types
+
+import pytest
+
+from model_pool import ModelPool
+
+
+class StubLlama:
+    """Records the contexts the pool creates; creation blocks while `gate` is clear"""
+    # 2 KB of f16 KV cache per token, 1 MB per 512 tokens
+    metadata = {
+        "general.architecture": "stub",
+        "stub.block_count": "1",
+        "stub.embedding_length": "512",
+        "stub.attention.head_count": "1",
+        "stub.attention.key_length": "512",
+        "stub.attention.value_length": "512",
+    }
+    created = []
+    gate = threading.Event()
+
+    def __init__(self, model_path: str, n_ctx: int = 512, vocab_only: bool = False, **kwargs):
+        self.gate.wait(5)
+        self.n_ctx = n_ctx
+        self.vocab_only = vocab_only
+        self.closed = False
+        if not vocab_only:
+            self.created.append(self)
+
+    def __call__(self, prompt: str, **kwargs):
+        return {"choices": [{"text": ""}]}
+
+    def reset(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture(autouse=True)
+def stub_llama(monkeypatch):
+    StubLlama.created = []
+    StubLlama.gate.set()
+    monkeypatch.setitem(sys.modules, "llama_cpp", types.SimpleNamespace(Llama=StubLlama))
+
+
+def test_context_sizes_that_do_not_fit_the_budget_are_dropped():
+    pool = ModelPool("model.gguf", size=2, context_sizes=(2048, 512, 1024), memory_budget_mb=2)
+    pool.load()
+    assert [llm.n_ctx for llm in StubLlama.created] == [512, 512]
+    assert pool.context_size(600) == 1024
+    assert pool.context_size(5000) == 1024
+    assert pool.tokenizer.vocab_only
+
+    with pytest.raises(ValueError):
+        ModelPool("model.gguf", context_sizes=(1024,), memory_budget_mb=1.5).load()
+
+
+def test_idle_contexts_are_evicted_for_a_larger_one():
+    pool = ModelPool("model.gguf", size=2, context_sizes=(512, 1024), memory_budget_mb=2)
+    pool.load()
+    small = list(StubLlama.created)
+
+    async def main():
+        async with pool.acquire(1000) as llm:
+            assert llm.n_ctx == 1024
+        # The larger context stays warm for the next long prompt
+        async with pool.acquire(900) as again:
+            assert again is llm
+
+    asyncio.run(main())
+    assert all(llm.closed for llm in small)
+    assert pool._kv_bytes == 2 * 2 ** 20
+
+
+def test_checkouts_wait_for_a_free_context():
+    pool = ModelPool("model.gguf", size=1, context_sizes=(512,))
+    pool.load()
+    entered = []
+
+    async def use(name, hold):
+        async with pool.acquire() as llm:
+            entered.append(name)
+            await hold.wait()
+            return llm
+
+    async def main():
+        first_done, second_done = asyncio.Event(), asyncio.Event()
+        first = asyncio.create_task(use("first", first_done))
+        second = asyncio.create_task(use("second", second_done))
+        await asyncio.sleep(0.05)
+        assert entered == ["first"]
+        first_done.set()
+        second_done.set()
+        return await first, await second
+
+    first, second = asyncio.run(main())
+    assert entered == ["first", "second"]
+    assert first is second
+    assert len(StubLlama.created) == 1
+
+
+def test_context_created_for_a_cancelled_checkout_is_kept():
+    pool = ModelPool("model.gguf", size=1, context_sizes=(512, 1024))
+    pool.load()
+
+    async def main():
+        StubLlama.gate.clear()
+        checkout = asyncio.create_task(pool.acquire(1000).__aenter__())
+        await asyncio.sleep(0.05)
+        checkout.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await checkout
+        StubLlama.gate.set()
+        for _ in range(200):
+            if pool._idle[1024]:
+                break
+            await asyncio.sleep(0.01)
+        assert pool._idle[1024], "the context created for the cancelled checkout was dropped"
+        async with pool.acquire(1000) as llm:
+            return llm
+
+    llm = asyncio.run(main())
+    small, large = StubLlama.created
+    # The pool holds one context, so the idle small one made room and the large one was reused
+    assert small.closed and not large.closed
+    assert llm is large
+    assert pool._kv_bytes == 1024 * 2048
@@ -0,0 +1,24 @@
+import time
+
+import page_store
+from page_store import PageStore
+
+
+def test_old_pages_are_pruned_by_index_once_per_interval(tmp_path, monkeypatch):
+    store = PageStore(str(tmp_path / "pages.db"), max_age=3600)
+    try:
+        plan = store._db.execute("EXPLAIN QUERY PLAN DELETE FROM pages WHERE fetched < 0").fetchall()
+        assert "pages_fetched" in str(plan)
+
+        store.put("https://shop.example/old", "<p>old</p>", "old")
+        store._db.execute("UPDATE pages SET fetched = ?", (time.time() - 7200,))
+        # The first write pruned already, the next ones wait for the interval
+        store.put("https://shop.example/new", "<p>new</p>", "new")
+        assert len(store.urls()) == 2
+        monkeypatch.setattr(page_store.time, "time", lambda: store._next_prune)
+        store.put("https://shop.example/newer", "<p>newer</p>", "newer")
+        assert sorted(url for url, _ in store.urls()) == ["https://shop.example/new", "https://shop.example/newer"]
+        # Expired pages are never served, pruned or not
+        assert store.get("https://shop.example/old") is None
+    finally:
+        store.close()
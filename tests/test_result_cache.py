@@ -0,0 +1,53 @@
+import asyncio
+import types
+
+from pipeline import has_findings
+from result_cache import ResultCache
+
+EMPTY_SITE = {"site_name": "Error Site", "rating": "No data", "pros": "No data", "cons": "No data"}
+FOUND_SITE = {"site_name": "Example", "rating": "8/10", "pros": "* Bright screen", "cons": "No data"}
+
+
+def test_results_without_findings_are_not_cached():
+    cache = ResultCache(cacheable=has_findings)
+    cache.set("phone", {"product_info": [], "summary": "Nothing found"})
+    cache.set("tablet", {"product_info": [EMPTY_SITE], "summary": "Nothing found"})
+    assert cache.get("phone") is None
+    assert cache.get("tablet") is None
+
+    result = {"product_info": [EMPTY_SITE, FOUND_SITE], "summary": "Good"}
+    cache.set("Laptop", result)
+    assert cache.get("laptop") == result
+
+
+def test_concurrent_analyses_share_one_job_and_one_cache_write(monkeypatch):
+    import app
+    import pipeline
+    from job_queue import JobQueue
+
+    runs, writes = [], []
+
+    async def stream_analysis(state, product_name):
+        runs.append(product_name)
+        await asyncio.sleep(0.01)
+        yield {"event": "search", "sites": []}
+        yield {"event": "summary", "product_info": [EMPTY_SITE], "summary": "Nothing found"}
+
+    monkeypatch.setattr(pipeline, "stream_analysis", stream_analysis)
+    cache = ResultCache(cacheable=has_findings)
+    monkeypatch.setattr(cache, "set", lambda *args: writes.append(args) or ResultCache.set(cache, *args))
+    state = types.SimpleNamespace(result_cache=cache)
+
+    async def main():
+        state.job_queue = JobQueue(lambda job: pipeline.run_job(state, job), workers=2)
+        state.job_queue.start()
+        try:
+            return await asyncio.gather(*(app.analyze_cached(state, name) for name in ("phone", "Phone ", "phone")))
+        finally:
+            await state.job_queue.stop()
+
+    results = asyncio.run(main())
+    assert [result["summary"] for result in results] == ["Nothing found"] * 3
+    assert len(runs) == 1
+    assert len(writes) == 1
+    assert cache.get("phone") is None
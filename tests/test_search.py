@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+
+import services
+from domain_health import DomainHealth
+from page_store import PageStore
+
+
+def test_search_returns_first_results_and_collects_spares_in_background(monkeypatch):
+    threads = []
+
+    def slow_search(query, num_results):
+        threads.append(threading.current_thread().name)
+        for n in range(num_results):
+            if n >= 2:
+                time.sleep(0.1)
+            yield f"https://site{n}.example/review"
+
+    class NoDDGS:
+        def text(self, query, max_results):
+            return []
+
+    monkeypatch.setattr(services, "search_providers", lambda: (NoDDGS, slow_search))
+    health = DomainHealth()
+    # A domain whose pages never had anything to extract is used last
+    for _ in range(3):
+        health.record_fetch("https://site0.example/other", ok=True)
+        health.record_analysis("https://site0.example/other", useful=False)
+
+    async def main():
+        fetcher = services.ReviewFetcher("phone", browser_pool=None, domain_health=health)
+        start = time.perf_counter()
+        links = await fetcher.search_google(num_results=2, spare_results=2)
+        seconds = time.perf_counter() - start
+        spares_at_return = list(fetcher._spare_links)
+        await fetcher._spare_search
+        return links, seconds, spares_at_return, fetcher._spare_links
+
+    links, seconds, spares_at_return, spares = asyncio.run(main())
+    assert links == ["https://site1.example/review", "https://site2.example/review"]
+    assert seconds < 0.3
+    assert spares_at_return == ["https://site0.example/review"]
+    assert spares == ["https://site0.example/review", "https://site3.example/review"]
+    # Providers run on the search threads, not on the ones inference uses
+    assert threads[0].startswith("search")
+
+
+def test_page_store_hits_do_not_count_as_fetches(tmp_path):
+    store = PageStore(str(tmp_path / "pages.db"))
+    store.put("https://shop.example/review", "<html><body><p>Phone review</p></body></html>", "Phone review")
+    health = DomainHealth()
+
+    async def main():
+        fetcher = services.ReviewFetcher("phone", browser_pool=None, page_store=store, domain_health=health)
+        fetcher._links = ["https://shop.example/review"]
+        fetcher._site_names = ["Shop"]
+        return [page async for page in fetcher.iter_pages()]
+
+    try:
+        pages = asyncio.run(main())
+    finally:
+        store.close()
+    assert pages == [(0, "Shop", "Phone review", None)]
+    assert "shop.example" not in health.as_dict()
@@ -0,0 +1,76 @@
+import json
+
+from markdown_converter import parse_html
+from services import ReviewAnalyzer
+from structured_data import StructuredReview, extract_structured_data
+
+
+def json_ld(*items) -> str:
+    scripts = "".join(f'<script type="application/ld+json">{json.dumps(item)}</script>' for item in items)
+    return f"<html><head>{scripts}</head><body><p>Review</p></body></html>"
+
+
+def product(name, rating, best=5, count=None, **extra):
+    aggregate = {"@type": "AggregateRating", "ratingValue": rating, "bestRating": best}
+    if count is not None:
+        aggregate["reviewCount"] = count
+    return {"@type": "Product", "name": name, "aggregateRating": aggregate, **extra}
+
+
+def extract(html, name="Pixel 8 Pro"):
+    return extract_structured_data(parse_html(html), name)
+
+
+def test_rating_of_another_product_is_not_trusted():
+    html = json_ld(product("Galaxy S24 Ultra", 4.8), product("Google Pixel 8 Pro", 4.1))
+    review = extract(html)
+    assert (review.rating, review.best_rating, review.source) == (4.1, 5, "json-ld AggregateRating")
+    assert extract(json_ld(product("Galaxy S24 Ultra", 4.8))) is None
+
+
+def test_unnamed_rating_is_only_trusted_alone():
+    unnamed = {"@type": "AggregateRating", "ratingValue": "8,5", "bestRating": "10",
+               "itemReviewed": {"@type": "Thing"}}
+    assert extract(json_ld(unnamed)).rating_text == "8.5/10"
+    assert extract(json_ld(unnamed, {**unnamed, "ratingValue": 3})) is None
+
+
+def test_rating_outside_its_scale_is_dropped():
+    assert extract(json_ld(product("Pixel 8 Pro", 8, best=5))) is None
+    assert extract(json_ld(product("Pixel 8 Pro", 8, best=10))).rating == 8
+
+
+def test_rating_with_most_reviews_wins_and_keeps_notes_of_the_others():
+    notes = {"positiveNotes": {"itemListElement": [{"name": "Camera"}]}, "negativeNotes": ["Price"]}
+    review = {"@type": "Review", "itemReviewed": {"name": "Pixel 8 Pro"},
+              "reviewRating": {"ratingValue": 9, "bestRating": 10}, **notes}
+    html = json_ld(product("Pixel 8 Pro", 4.2, count=120), product("Pixel 8 Pro", 4.6, count=15), review)
+    best = extract(html)
+    assert (best.rating, best.review_count) == (4.2, 120)
+    assert (best.pros, best.cons) == (["Camera"], ["Price"])
+
+
+def test_microdata_rating():
+    html = """<html><body><div itemscope itemtype="https://schema.org/Product">
+        <h1 itemprop="name">Pixel 8 Pro</h1>
+        <div itemprop="aggregateRating" itemscope itemtype="https://schema.org/AggregateRating">
+            <span itemprop="ratingValue">4.4</span> of <meta itemprop="bestRating" content="5">
+            <span itemprop="reviewCount">31</span>
+        </div></div></body></html>"""
+    review = extract(html)
+    assert (review.rating, review.best_rating, review.review_count) == (4.4, 5, 31)
+    assert review.source == "microdata aggregateRating"
+
+
+class Tokenizer:
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> list[int]:
+        return list(range(len(text.split())))
+
+
+def test_known_rating_is_not_asked_again():
+    analyzer = ReviewAnalyzer("Pixel 8 Pro", [""], ["Site"], tokenizer=Tokenizer())
+    content = "Pixel 8 Pro review. The camera is great, the battery is fine."
+    prompt = analyzer.prepare_site(0, content, structured=StructuredReview(rating=4.5))
+    assert "rating" not in prompt and "PROS and CONS" in prompt
+    prompt = analyzer.prepare_site(0, content, structured=None)
+    assert "Extract the rating" in prompt